@@ -1,48 +1,215 @@
 import os
+import re
+import time
+import hashlib
+import datetime
+import asyncio
 import aiohttp
 import json
 
-OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+from tortoise.expressions import F
+
+from database import AvaliacaoIA, Submissao
+from http_client import HTTP_CONNECT_TIMEOUT, get_session
+from metrics import record_fetch, record_ollama_call
+from ollama_pool import ollama_pool
+
 OLLAMA_MODEL_CHALLENGE = os.getenv("OLLAMA_MODEL_CHALLENGE", "llama3:8b")
 OLLAMA_MODEL_ANALYSIS = os.getenv("OLLAMA_MODEL_ANALYSIS", "codellama:7b")
-OLLAMA_API_ENDPOINT = f"{OLLAMA_HOST}/api/generate"
+
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", "20"))
+OLLAMA_CONCURRENCY = int(os.getenv("OLLAMA_CONCURRENCY", "2")) # por nó do Ollama
+
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "300"))
+OLLAMA_STREAM = os.getenv("OLLAMA_STREAM", "1") == "1"
+
+# Incrementar sempre que o prompt de análise mudar, para invalidar o cache de notas.
+ANALYSIS_PROMPT_VERSION = "1"
+NOTA_MAXIMA_IA = 5 # a escala pedida no prompt de análise
+SCORE_CACHE_MAX_ENTRIES = int(os.getenv("SCORE_CACHE_MAX_ENTRIES", "50000"))
+SCORE_CACHE_MAX_AGE_DAYS = int(os.getenv("SCORE_CACHE_MAX_AGE_DAYS", "90"))
+FETCH_READ_TIMEOUT = float(os.getenv("FETCH_READ_TIMEOUT", "20"))
+# Espera antes de pré-avaliar de novo uma submissão em que a IA falhou; dobra a cada falha.
+PRE_SCORE_RETRY_SECONDS = float(os.getenv("PRE_SCORE_RETRY_SECONDS", "300"))
+PRE_SCORE_MAX_ATTEMPTS = int(os.getenv("PRE_SCORE_MAX_ATTEMPTS", "5")) # depois disso fica para o /encerrar-votacao
 
 ## FEAT PARA CHAMAR O OLLAMA ##
 
-async def _call_ollama(model_name: str, prompt: str, expect_json: bool = True):
+class _JsonObjectScanner:
+    # Acompanha o JSON gerado token a token (respeitando strings e escapes) e
+    # devolve candidatos completos: o objeto inteiro quando ele fecha, ou os
+    # membros de primeiro nível já terminados a cada vírgula.
+    def __init__(self):
+        self.texto = ""
+        self.inicio = None
+        self.fechado = False
+        self._pos = 0
+        self._profundidade = 0
+        self._em_string = False
+        self._escape = False
+
+    def feed(self, pedaco: str) -> list:
+        self.texto += pedaco
+        candidatos = []
+
+        for i in range(self._pos, len(self.texto)):
+            c = self.texto[i]
+
+            if self._em_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._em_string = False
+                continue
+
+            if self.inicio is None:
+                if c == '{':
+                    self.inicio = i
+                    self._profundidade = 1
+                continue
+
+            if c == '"':
+                self._em_string = True
+            elif c in '{[':
+                self._profundidade += 1
+            elif c in '}]':
+                self._profundidade -= 1
+                if self._profundidade == 0:
+                    self.fechado = True
+                    self._pos = i + 1
+                    candidatos.append(self.texto[self.inicio:i + 1])
+                    return candidatos
+            elif c == ',' and self._profundidade == 1:
+                candidatos.append(self.texto[self.inicio:i] + '}')
+
+        self._pos = len(self.texto)
+        return candidatos
+
+def _token_usage(data: dict, uso: dict):
+    # O Ollama só manda as contagens na última resposta (done=true).
+    if 'prompt_eval_count' in data:
+        uso['prompt'] = data['prompt_eval_count']
+    if 'eval_count' in data:
+        uso['gerados'] = data['eval_count']
+
+async def _read_ollama_stream(response, required_keys, uso: dict):
+    scanner = _JsonObjectScanner()
+
+    async for linha in response.content:
+        linha = linha.strip()
+        if not linha:
+            continue
+
+        chunk = json.loads(linha)
+        # Cada linha do stream é um token; se cortarmos antes do fim, fica essa contagem.
+        uso['gerados'] = uso.get('gerados', 0) + 1
+        _token_usage(chunk, uso)
+        if chunk.get('error'):
+            return None, f"Erro do servidor Ollama: {chunk['error']}"
+
+        for candidato in scanner.feed(chunk.get('response', '')):
+            try:
+                data = json.loads(candidato)
+            except json.JSONDecodeError:
+                continue
+
+            if scanner.fechado or all(chave in data for chave in required_keys):
+                # Fecha a conexão para o Ollama interromper a geração do resto.
+                if not chunk.get('done'):
+                    response.close()
+                return candidato, None
+
+        if chunk.get('done'):
+            break
+
+    if scanner.texto.strip():
+        return scanner.texto, None
+    return None, "Ollama retornou uma resposta vazia."
+
+_ollama_in_flight = 0
+
+def ollama_capacity() -> int:
+    return OLLAMA_CONCURRENCY * max(len(ollama_pool.healthy_nodes()), 1)
+
+def ollama_idle_slots() -> int:
+    return max(ollama_capacity() - _ollama_in_flight, 0)
+
+async def _call_ollama(model_name: str, prompt: str, expect_json: bool = True, required_keys: tuple = ()):
+    global _ollama_in_flight
+
+    _ollama_in_flight += 1
+    try:
+        return await _request_ollama(model_name, prompt, expect_json, required_keys)
+    finally:
+        _ollama_in_flight -= 1
+
+async def _request_ollama(model_name: str, prompt: str, expect_json: bool, required_keys: tuple):
+    # Sem conexão com o nó escolhido nada foi gerado ainda, então tenta o próximo.
+    tentados = []
+    resposta, erro = None, "Nenhum nó do Ollama configurado."
+    for _ in range(len(ollama_pool.nodes)):
+        node = ollama_pool.pick(model_name, excluir=tentados)
+        tentados.append(node)
+        node.em_andamento += 1
+        try:
+            resposta, erro, conectou = await _request_ollama_node(node, model_name, prompt, expect_json, required_keys)
+        finally:
+            node.em_andamento -= 1
+        if conectou:
+            return resposta, erro
+    return resposta, erro
+
+async def _request_ollama_node(node, model_name: str, prompt: str, expect_json: bool, required_keys: tuple):
+    stream = OLLAMA_STREAM and expect_json and bool(required_keys)
+
     payload = {
         "model": model_name,
         "prompt": prompt,
-        "stream": False
+        "stream": stream
     }
 
     if expect_json:
         payload["format"] = "json"
 
+    # O timeout da requisição substitui o da sessão por inteiro, então o connect é repetido aqui.
+    timeout = aiohttp.ClientTimeout(total=None, connect=HTTP_CONNECT_TIMEOUT, sock_read=OLLAMA_READ_TIMEOUT)
+    inicio = time.monotonic()
+    uso = {}
+
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(OLLAMA_API_ENDPOINT, json=payload) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    print(f"Erro do Ollama (Status {response.status}): {error_text}")
-                    return None, f"Erro do servidor Ollama: {error_text}"
-                
-                data = await response.json()
+        session = get_session()
+        async with session.post(f"{node.url}/api/generate", json=payload, timeout=timeout) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                print(f"Erro do Ollama em {node.url} (Status {response.status}): {error_text}")
+                if response.status >= 500:
+                    ollama_pool.report_failure(node, f"status {response.status}")
+                return None, f"Erro do servidor Ollama: {error_text}", True
 
-                response_content = data.get('response')
+            if stream:
+                resposta, erro = await _read_ollama_stream(response, required_keys, uso)
+            else:
+                data = await response.json()
+                _token_usage(data, uso)
+                resposta = data.get('response')
+                erro = None if resposta else "Ollama retornou uma resposta vazia."
 
-                if not response_content:
-                    return None, "Ollama retornou uma resposta vazia."
-                
-                return response_content, None
+            ollama_pool.report_success(node, model_name)
+            return resposta, erro, True
             
     except aiohttp.ClientConnectorError:
-        return None, "Erro de Conexão: Não foi possível se conectar ao servidor Ollama. Ele está rodando?"
-    except aiohttp.ClientTimeout:
-        return None, "Erro de Timeout: A IA demorou muito para responder."
+        ollama_pool.report_failure(node, "sem conexão")
+        return None, "Erro de Conexão: Não foi possível se conectar ao servidor Ollama. Ele está rodando?", False
+    except asyncio.TimeoutError:
+        ollama_pool.report_failure(node, "timeout")
+        return None, "Erro de Timeout: A IA demorou muito para responder.", True
     except Exception as e:
         print(f"Erro desconhecido ao chamar Ollama: {e}")
-        return None, f"Erro inesperado: {e}"  
+        return None, f"Erro inesperado: {e}", True
+    finally:
+        record_ollama_call(model_name, time.monotonic() - inicio, uso.get('prompt'), uso.get('gerados'), node.url)
     
 ## FEAT DE GERAR DESAFIOS ##
 
@@ -82,7 +249,9 @@ async def generate_ai_challenge(nivel : str, tema: str):
       a descrição (ex: "## Objetivo\\n...", "## Requisitos\\n...").
     """
 
-    json_str, error = await _call_ollama(OLLAMA_MODEL_CHALLENGE, prompt, expect_json=True)
+    json_str, error = await _call_ollama(
+        OLLAMA_MODEL_CHALLENGE, prompt, expect_json=True, required_keys=("titulo", "descricao")
+    )
     
     if error:
         return None, error
@@ -116,19 +285,87 @@ async def fetch_code_from_url(url: str) -> str:
             url = url[:-1]
         url = url.replace('pastebin.com/', 'pastebin.com/raw/')
 
+    timeout = aiohttp.ClientTimeout(total=None, connect=HTTP_CONNECT_TIMEOUT, sock_read=FETCH_READ_TIMEOUT)
+
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                if resp.status == 200:
-                    return await resp.text()
-                else:
-                    print(f"Erro ao buscar código: Status {resp.status}")
-                    return None
+        session = get_session()
+        async with session.get(url, timeout=timeout) as resp:
+            if resp.status == 200:
+                codigo = await resp.text()
+                record_fetch(len(codigo.encode()))
+                return codigo
+            else:
+                print(f"Erro ao buscar código: Status {resp.status}")
+                return None
     except Exception as e:
         print(f"Erro de rede ao buscar código: {e}")
         return None
 
+## CACHE DE NOTAS DA IA ##
+
+def _normalize_code(code_text: str) -> str:
+    linhas = code_text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    return '\n'.join(linha.rstrip() for linha in linhas).strip('\n')
+
+def score_cache_key(code_text: str, challenge_description: str, model_name: str = OLLAMA_MODEL_ANALYSIS) -> str:
+    descricao = re.sub(r'\s+', ' ', challenge_description).strip()
+    conteudo = '\0'.join([ANALYSIS_PROMPT_VERSION, model_name, descricao, _normalize_code(code_text)])
+    return hashlib.sha256(conteudo.encode('utf-8')).hexdigest()
+
+async def _get_cached_score(chave: str):
+    try:
+        avaliacao = await AvaliacaoIA.get_or_none(chave=chave)
+    except Exception as e:
+        print(f"[AVISO] Falha ao consultar cache de notas: {e}")
+        return None
+
+    if avaliacao is None:
+        return None
+    return avaliacao.nota, avaliacao.justificativa
+
+async def _store_cached_score(chave: str, nota: int, justificativa: str):
+    try:
+        await AvaliacaoIA.update_or_create(
+            chave=chave,
+            defaults={"modelo": OLLAMA_MODEL_ANALYSIS, "nota": nota, "justificativa": justificativa}
+        )
+    except Exception as e:
+        print(f"[AVISO] Falha ao salvar nota no cache: {e}")
+
+async def prune_score_cache():
+    limite_idade = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=SCORE_CACHE_MAX_AGE_DAYS)
+    removidas = await AvaliacaoIA.filter(criado_em__lt=limite_idade).delete()
+
+    corte = await AvaliacaoIA.all().order_by('-criado_em').offset(SCORE_CACHE_MAX_ENTRIES).first()
+    if corte:
+        removidas += await AvaliacaoIA.filter(criado_em__lte=corte.criado_em).delete()
+
+    return removidas
+
 async def get_ai_score(code_text: str, challenge_description: str):
+    nota, justificativa, _ = await evaluate_code(code_text, challenge_description)
+    return nota, justificativa
+
+def _parse_score(valor):
+    # A IA às vezes devolve "4", 4.0, "8/10" ou notas fora da escala; só vale inteiro de 0 a NOTA_MAXIMA_IA.
+    if isinstance(valor, bool):
+        return None
+    try:
+        numero = float(valor)
+    except (TypeError, ValueError):
+        return None
+    if not numero.is_integer() or not 0 <= numero <= NOTA_MAXIMA_IA:
+        return None
+    return int(numero)
+
+async def evaluate_code(code_text: str, challenge_description: str):
+    # Igual ao get_ai_score, mas indica se a nota veio de fato da IA (True) ou de um erro (False).
+    code_text = _normalize_code(code_text)
+    chave = score_cache_key(code_text, challenge_description)
+
+    cached = await _get_cached_score(chave)
+    if cached and _parse_score(cached[0]) is not None:
+        return cached[0], cached[1], True
 
     prompt = f"""
     Você é um Juiz Sênior de um desafio de programação.
@@ -145,23 +382,155 @@ async def get_ai_score(code_text: str, challenge_description: str):
     3. Legibilidade
     
     Responda APENAS com um objeto JSON com duas chaves:
-    1. "nota": Um número inteiro de 0 a 5.
+    1. "nota": Um número inteiro de 0 a {NOTA_MAXIMA_IA}.
     2. "justificativa": Um parágrafo curto (máx 3-4 frases) explicando a nota.
     """
     
-    json_str, error = await _call_ollama(OLLAMA_MODEL_ANALYSIS, prompt, expect_json=True)
+    json_str, error = await _call_ollama(
+        OLLAMA_MODEL_ANALYSIS, prompt, expect_json=True, required_keys=("nota", "justificativa")
+    )
     
     if error:
-        return 0, error
+        return 0, error, False
         
     try:
         json_text = json_str.strip().replace('```json', '').replace('```', '')
         data = json.loads(json_text)
-        return data.get('nota', 0), data.get('justificativa', 'Nenhuma justificativa fornecida.')
+        nota = data.get('nota', 0)
+        justificativa = data.get('justificativa', 'Nenhuma justificativa fornecida.')
         
     except json.JSONDecodeError:
         print(f"Erro de JSON da IA (análise): A IA não retornou um JSON válido. Resposta: {json_str}")
-        return 0, "A IA retornou um formato de texto inválido."
+        return 0, "A IA retornou um formato de texto inválido.", False
     except Exception as e:
         print(f"Erro ao processar análise da IA: {e}")
-        return 0, f"Erro: {e}"
\ No newline at end of file
+        return 0, f"Erro: {e}", False
+
+    # A nota vai para um IntField e para um CAST AS INTEGER: nada fora da escala passa daqui.
+    nota_valida = _parse_score(nota)
+    if nota_valida is None:
+        return 0, f"A IA retornou uma nota inválida: {nota}", False
+    nota = nota_valida
+
+    # Só respostas bem formadas entram no cache; erros voltam a ser tentados.
+    if 'justificativa' not in data:
+        return nota, justificativa, False
+
+    await _store_cached_score(chave, nota, str(justificativa))
+    return nota, justificativa, True
+
+## FEAT DE PRÉ-AVALIAÇÃO EM SEGUNDO PLANO ##
+
+async def pre_score_submission(sub, challenge_description: str) -> bool:
+    # Guarda a nota direto na Submissao. O filtro por link_codigo/nota_ia evita gravar
+    # uma nota antiga se o usuário trocou o link enquanto a IA avaliava.
+    code_text = await fetch_code_from_url(sub.link_codigo)
+
+    if not code_text:
+        await Submissao.filter(id=sub.id, link_codigo=sub.link_codigo, nota_ia=None).update(
+            justificativa_ia="Erro ao buscar o código do link."
+        )
+        return False
+
+    nota, justificativa, sucesso = await evaluate_code(code_text, challenge_description)
+    if not sucesso:
+        # Sem isso a submissão continuaria no topo da fila e seria tentada de novo a cada rodada.
+        espera = PRE_SCORE_RETRY_SECONDS * 2 ** sub.tentativas_ia
+        await Submissao.filter(id=sub.id, link_codigo=sub.link_codigo, nota_ia=None).update(
+            tentativas_ia=F("tentativas_ia") + 1,
+            proxima_tentativa_ia=datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=espera)
+        )
+        print(f"[PRÉ-AVALIAÇÃO] Submissão {sub.id} não avaliada (nova tentativa em {espera:.0f}s): {justificativa}")
+        return False
+
+    return await store_submission_score(sub, nota, justificativa)
+
+async def store_submission_score(sub, nota: int, justificativa: str) -> bool:
+    atualizadas = await Submissao.filter(id=sub.id, link_codigo=sub.link_codigo, nota_ia=None).update(
+        nota_ia=nota, justificativa_ia=justificativa
+    )
+    return atualizadas > 0
+
+## FEAT DE JULGAMENTO EM LOTE ##
+
+class JudgingProgress:
+    def __init__(self, total: int):
+        self.total = total
+        self.baixados = 0
+        self.avaliados = 0
+        self.falhas = 0
+        self.inicio = time.monotonic()
+
+    @property
+    def concluidos(self) -> int:
+        return self.avaliados + self.falhas
+
+    def resumo(self) -> str:
+        decorrido = max(time.monotonic() - self.inicio, 0.001)
+        por_minuto = self.avaliados / decorrido * 60
+        return (
+            f"Analisando submissões com a IA... {self.concluidos}/{self.total} concluídas\n"
+            f"📥 Códigos baixados: {self.baixados} | 🤖 Avaliados: {self.avaliados} | ❌ Falhas: {self.falhas}\n"
+            f"⏱️ {decorrido:.0f}s decorridos | {por_minuto:.1f} avaliações/min"
+        )
+
+async def judge_submissions(submissoes, challenge_description: str, progresso: JudgingProgress = None,
+                            fetch_concurrency: int = FETCH_CONCURRENCY, llm_workers: int = None,
+                            on_result=None):
+    # Baixa todos os códigos em paralelo (limitado por fetch_concurrency) e entrega
+    # para um pool separado de workers do Ollama, dimensionado pelos nós saudáveis.
+    # on_result(sub, nota, justificativa) é chamado a cada nota que veio de fato da IA.
+    if progresso is None:
+        progresso = JudgingProgress(len(submissoes))
+    if llm_workers is None:
+        llm_workers = ollama_capacity()
+
+    resultados = {}
+    fila = asyncio.Queue(maxsize=max(llm_workers * 2, 1))
+    limite_fetch = asyncio.Semaphore(fetch_concurrency)
+
+    async def baixar(sub):
+        async with limite_fetch:
+            code_text = await fetch_code_from_url(sub.link_codigo)
+
+        if not code_text:
+            print(f"Não foi possível buscar o código da submissão {sub.id} (Link: {sub.link_codigo})")
+            resultados[sub.id] = (None, "Erro ao buscar o código do link.")
+            progresso.falhas += 1
+            return
+
+        progresso.baixados += 1
+        await fila.put((sub, code_text))
+
+    async def avaliar():
+        while True:
+            sub, code_text = await fila.get()
+            try:
+                nota, justificativa, sucesso = await evaluate_code(code_text, challenge_description)
+                if not sucesso:
+                    # Sem nota da IA: o 0 de evaluate_code não pode virar pontuação.
+                    resultados[sub.id] = (None, justificativa)
+                    progresso.falhas += 1
+                    continue
+
+                resultados[sub.id] = (nota, justificativa)
+                progresso.avaliados += 1
+                if on_result is not None:
+                    await on_result(sub, nota, justificativa)
+            except Exception as e:
+                print(f"Erro ao avaliar submissão {sub.id}: {e}")
+                resultados[sub.id] = (None, f"Erro: {e}")
+                progresso.falhas += 1
+            finally:
+                fila.task_done()
+
+    workers = [asyncio.create_task(avaliar()) for _ in range(max(llm_workers, 1))]
+    try:
+        await asyncio.gather(*(baixar(sub) for sub in submissoes))
+        await fila.join()
+    finally:
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    return resultados
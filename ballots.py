@@ -0,0 +1,188 @@
+import os
+import re
+import time
+import asyncio
+import discord
+
+from database import Submissao
+from metrics import medir
+from voting import EMOJI_VOTO, record_vote, remove_vote, vote_index
+
+# O Discord libera ~5 mensagens a cada 5s por canal e reações bem mais rápido,
+# em buckets separados. Os envios seguem esse ritmo localmente em vez de bater
+# no 429 e esperar o retry da biblioteca a cada cédula.
+BALLOT_BURST = int(os.getenv("BALLOT_BURST", "5"))
+BALLOT_SENDS_PER_SECOND = float(os.getenv("BALLOT_SENDS_PER_SECOND", "1"))
+BALLOT_REACTIONS_PER_SECOND = float(os.getenv("BALLOT_REACTIONS_PER_SECOND", "4"))
+BALLOT_CONCURRENCY = int(os.getenv("BALLOT_CONCURRENCY", "4"))
+BALLOT_SAVE_EVERY = int(os.getenv("BALLOT_SAVE_EVERY", "25"))
+BALLOT_RECOVERY_SCAN = int(os.getenv("BALLOT_RECOVERY_SCAN", "500"))
+# "botao", "reacao" ou "ambos". Reações em cédulas antigas continuam valendo em qualquer modo.
+BALLOT_VOTE_MODE = os.getenv("BALLOT_VOTE_MODE", "botao")
+
+RODAPE_CEDULA = "ID da Submissão: {}"
+_RE_RODAPE_CEDULA = re.compile(r"ID da Submissão: (\d+)")
+
+## LIMITE DE TAXA LOCAL ##
+
+class TokenBucket:
+    def __init__(self, capacidade: int, por_segundo: float):
+        self.capacidade = capacidade
+        self.por_segundo = por_segundo
+        self._tokens = float(capacidade)
+        self._atualizado = time.monotonic()
+        self._bloqueado_ate = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Quem chega primeiro envia primeiro: a espera acontece com o lock preso.
+        async with self._lock:
+            while True:
+                agora = time.monotonic()
+                if agora < self._bloqueado_ate:
+                    await asyncio.sleep(self._bloqueado_ate - agora)
+                    continue
+
+                self._tokens = min(self.capacidade, self._tokens + (agora - self._atualizado) * self.por_segundo)
+                self._atualizado = agora
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.por_segundo)
+
+    def penalize(self, retry_after: float):
+        # Recebemos 429 mesmo assim: ninguém envia até o Retry-After passar.
+        self._tokens = 0.0
+        self._bloqueado_ate = max(self._bloqueado_ate, time.monotonic() + retry_after)
+
+async def _call_rate_limited(bucket: TokenBucket, chamada):
+    while True:
+        await bucket.acquire()
+        try:
+            return await chamada()
+        except discord.RateLimited as e:
+            bucket.penalize(e.retry_after)
+        except discord.HTTPException as e:
+            if e.status != 429:
+                raise
+            bucket.penalize(float(e.response.headers.get("Retry-After", 1)))
+
+## VOTO POR BOTÃO ##
+# O custom_id do botão carrega o id da submissão, então o clique não precisa
+# descobrir a qual submissão a mensagem pertence. Como é um DynamicItem, o
+# botão continua funcionando depois de um restart sem registrar uma View por
+# cédula. O voto passa pelo mesmo record_vote/remove_vote do /votar-jurado.
+
+class VoteButton(discord.ui.DynamicItem[discord.ui.Button], template=r"voto:(?P<submissao_id>\d+)"):
+    def __init__(self, submissao_id: int):
+        self.submissao_id = submissao_id
+        super().__init__(discord.ui.Button(
+            label="Votar",
+            emoji=EMOJI_VOTO,
+            style=discord.ButtonStyle.primary,
+            custom_id=f"voto:{submissao_id}"
+        ))
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(int(match["submissao_id"]))
+
+    @medir("voto-botao")
+    async def callback(self, interaction: discord.Interaction):
+        mensagem_id = interaction.message.id
+        entrada = vote_index.get(mensagem_id) or await vote_index.resolve(mensagem_id, self.submissao_id)
+
+        if entrada is None or entrada[0] != self.submissao_id:
+            await interaction.response.send_message("❌ A votação desta submissão já foi encerrada.", ephemeral=True)
+            return
+
+        # Clicar de novo retira o voto, como tirar a reação.
+        if await record_vote(self.submissao_id, interaction.user.id, interaction.user.name, "comunidade", mensagem_id):
+            resposta = "✅ Voto registrado! Clique de novo para retirar."
+        elif await remove_vote(interaction.user.id, mensagem_id, "comunidade") is not None:
+            resposta = "↩️ Voto retirado."
+        else:
+            resposta = "⚠️ Você já votou nesta submissão."
+
+        await interaction.response.send_message(resposta, ephemeral=True)
+
+def build_ballot_view(submissao_id: int) -> discord.ui.View:
+    view = discord.ui.View(timeout=None)
+    view.add_item(VoteButton(submissao_id))
+    return view
+
+## PUBLICAÇÃO DAS CÉDULAS ##
+
+def build_ballot_embed(submissao: Submissao) -> discord.Embed:
+    embed = discord.Embed(
+        title=f"Solução de: {submissao.usuario.username}",
+        description=f"Link para o código: {submissao.link_codigo}",
+        color=discord.Color.gold()
+    )
+    embed.set_footer(text=RODAPE_CEDULA.format(submissao.id))
+    return embed
+
+async def _recover_posted(canal, pendentes: dict, bot_id: int) -> dict:
+    # Cédulas enviadas antes de uma interrupção, mas cujo id não chegou a ser salvo.
+    recuperadas = {}
+    async for mensagem in canal.history(limit=BALLOT_RECOVERY_SCAN):
+        if mensagem.author.id != bot_id or not mensagem.embeds:
+            continue
+
+        rodape = _RE_RODAPE_CEDULA.fullmatch(mensagem.embeds[0].footer.text or "")
+        if rodape is None:
+            continue
+
+        submissao_id = int(rodape.group(1))
+        if submissao_id in pendentes and submissao_id not in recuperadas:
+            recuperadas[submissao_id] = mensagem
+    return recuperadas
+
+async def publish_ballots(canal, desafio_id: int, submissoes: list, bot_id: int, retomando: bool = False) -> int:
+    # Só posta as cédulas que ainda não têm mensagem, então rodar de novo continua de onde parou.
+    pendentes = {sub.id: sub for sub in submissoes if sub.mensagem_votacao_id is None}
+    if not pendentes:
+        return 0
+
+    recuperadas = await _recover_posted(canal, pendentes, bot_id) if retomando else {}
+    if recuperadas:
+        print(f"[VOTAÇÃO] {len(recuperadas)} cédulas do desafio {desafio_id} recuperadas do histórico do canal.")
+
+    envios = TokenBucket(BALLOT_BURST, BALLOT_SENDS_PER_SECOND)
+    reacoes = TokenBucket(BALLOT_BURST, BALLOT_REACTIONS_PER_SECOND)
+    fila = list(pendentes.values())
+    concluidas = []
+
+    async def salvar():
+        lote = concluidas[:]
+        concluidas.clear()
+        if lote:
+            await Submissao.bulk_update(lote, fields=["mensagem_votacao_id"])
+
+    async def worker():
+        while fila:
+            sub = fila.pop(0)
+
+            mensagem = recuperadas.get(sub.id)
+            if mensagem is None:
+                view = build_ballot_view(sub.id) if BALLOT_VOTE_MODE != "reacao" else discord.utils.MISSING
+                mensagem = await _call_rate_limited(envios, lambda: canal.send(embed=build_ballot_embed(sub), view=view))
+            if BALLOT_VOTE_MODE != "botao" and not any(reacao.me and str(reacao.emoji) == EMOJI_VOTO for reacao in mensagem.reactions):
+                await _call_rate_limited(reacoes, lambda: mensagem.add_reaction(EMOJI_VOTO))
+
+            sub.mensagem_votacao_id = mensagem.id
+            vote_index.register(mensagem.id, sub.id, desafio_id)
+            concluidas.append(sub)
+
+            if len(concluidas) >= BALLOT_SAVE_EVERY:
+                await salvar()
+
+    resultados = await asyncio.gather(
+        *(worker() for _ in range(min(BALLOT_CONCURRENCY, len(fila)))), return_exceptions=True
+    )
+    await salvar()
+
+    for resultado in resultados:
+        if isinstance(resultado, BaseException):
+            raise resultado
+    return len(pendentes)
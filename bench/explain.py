@@ -0,0 +1,170 @@
+import os
+import sys
+import json
+import datetime
+import asyncio
+import argparse
+
+# Roda a partir da raiz do repositório: python bench/explain.py --db postgres://...
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Tabelas pequenas por natureza (dezenas/centenas de linhas), onde Seq Scan é o plano certo.
+TABELAS_PEQUENAS = {"desafio"}
+
+## DADOS SINTÉTICOS ##
+# Gerados pelo próprio Postgres com generate_series: 1M votos leva segundos, não minutos.
+
+def seed_sql(usuarios: int, desafios: int, submissoes: int, votos_por_submissao: int, referencias: int) -> list:
+    from ai_integration import NOTA_MAXIMA_IA
+
+    return [
+        "TRUNCATE voto, submissao, desafio, historicoranking, usuario RESTART IDENTITY CASCADE",
+        f"""
+        INSERT INTO usuario (discord_id, username, pontos_total, pontos_semana, pontos_mes)
+        SELECT g, 'usuario' || g, (random() * 5000)::int, (random() * 300)::int, (random() * 1200)::int
+        FROM generate_series(1, {usuarios}) g
+        """,
+        # Só os dois últimos desafios ainda recebem submissões/votos, como em produção.
+        f"""
+        INSERT INTO desafio (id, titulo, descricao, nivel, status, data_inicio, data_fim_submissao)
+        SELECT g, 'Desafio ' || g, 'Descrição', 'junior',
+               CASE WHEN g = {desafios} THEN 'aberto' WHEN g = {desafios} - 1 THEN 'votacao' ELSE 'fechado' END,
+               now() - ({desafios} - g) * interval '7 days', now() - ({desafios} - g - 1) * interval '7 days'
+        FROM generate_series(1, {desafios}) g
+        """,
+        f"""
+        INSERT INTO submissao (id, desafio_id, usuario_id, mensagem_votacao_id, link_codigo, data_submissao,
+                               pontos_comunidade, pontos_jurados, pontos_ia, pontos_total, nota_ia, justificativa_ia,
+                               tentativas_ia)
+        SELECT g, 1 + (g - 1) % {desafios}, 1 + (g - 1) % {usuarios}, 1000000000 + g, 'https://pastebin.com/raw/' || g,
+               now() - g * interval '1 second', 0, 0, 0, 0,
+               CASE WHEN 1 + (g - 1) % {desafios} >= {desafios} - 1 THEN NULL ELSE (random() * {NOTA_MAXIMA_IA})::int END,
+               CASE WHEN 1 + (g - 1) % {desafios} >= {desafios} - 1 THEN NULL ELSE 'ok' END, 0
+        FROM generate_series(1, {submissoes}) g
+        """,
+        # Cada submissão recebe votos de usuários distintos (respeita o unique (submissao, usuario)).
+        f"""
+        INSERT INTO voto (submissao_id, usuario_id, tipo_voto, mensagem_id)
+        SELECT s, 1 + (s + k * 9973) % {usuarios}, CASE WHEN k = 0 THEN 'jurado' ELSE 'comunidade' END, 1000000000 + s
+        FROM generate_series(1, {submissoes}) s, generate_series(0, {votos_por_submissao - 1}) k
+        """,
+        f"""
+        INSERT INTO historicoranking (periodo, referencia, usuario_id, username, pontos, posicao)
+        SELECT CASE WHEN r % 2 = 0 THEN 'semana' ELSE 'mes' END, 'ref-' || r, p, 'usuario' || p, 1000 - p, p
+        FROM generate_series(1, {referencias}) r, generate_series(1, 1000) p
+        """,
+        "ANALYZE",
+    ]
+
+## CONSULTAS QUENTES ##
+# As mesmas consultas que o bot faz, montadas pelo ORM para o SQL ser idêntico.
+
+def hot_queries(usuarios: int, desafios: int, submissoes: int) -> dict:
+    from tortoise.expressions import Q
+    from ai_integration import PRE_SCORE_MAX_ATTEMPTS
+    from database import Desafio, HistoricoRanking, Submissao, Usuario, Voto, padded
+
+    submissao = submissoes // 2
+    usuario = 1 + (submissao + 9973) % usuarios
+    mensagem = 1000000000 + submissao
+
+    consultas = {
+        "remover reação (usuario, mensagem, tipo)": Voto.filter(
+            usuario_id=usuario, mensagem_id=mensagem, tipo_voto="comunidade"
+        ).limit(1),
+        "voto existente (submissao, usuario, tipo)": Voto.filter(
+            submissao_id=submissao, usuario_id=usuario, tipo_voto="comunidade"
+        ).limit(1),
+        "flush do buffer de votos (IN em lote)": Voto.filter(
+            submissao_id__in=padded(range(submissao, submissao + 20)),
+            usuario_id__in=padded(range(usuario, usuario + 50))
+        ).values("id", "submissao_id", "usuario_id", "tipo_voto"),
+        "cédulas por mensagem": Submissao.filter(
+            mensagem_votacao_id__in=padded(range(mensagem, mensagem + 30))
+        ).values_list("mensagem_votacao_id", "id"),
+        "submissões do desafio (encerrar)": Submissao.filter(desafio_id=desafios - 1),
+        "submissão do usuário no desafio (submeter)": Submissao.filter(desafio_id=desafios, usuario_id=usuario).limit(1),
+        "fila da pré-avaliação": Submissao.filter(
+            Q(proxima_tentativa_ia=None) | Q(proxima_tentativa_ia__lte=datetime.datetime.now(datetime.timezone.utc)),
+            nota_ia=None, justificativa_ia=None, tentativas_ia__lt=PRE_SCORE_MAX_ATTEMPTS,
+            desafio__status__in=[Desafio.Status.ABERTO, Desafio.Status.VOTACAO]
+        ).order_by("tentativas_ia", "data_submissao").limit(4),
+        "ranking anterior": HistoricoRanking.filter(periodo="semana", referencia="ref-2").order_by("posicao").limit(10),
+    }
+    for coluna in ("pontos_total", "pontos_semana", "pontos_mes"):
+        consultas[f"top 10 por {coluna}"] = Usuario.all().order_by(f"-{coluna}").limit(10)
+    return consultas
+
+def seq_scans(plano: dict) -> list:
+    encontrados = []
+    if plano.get("Node Type") == "Seq Scan" and plano.get("Relation Name") not in TABELAS_PEQUENAS:
+        encontrados.append(plano["Relation Name"])
+    for filho in plano.get("Plans", []):
+        encontrados += seq_scans(filho)
+    return encontrados
+
+def scan_nodes(plano: dict) -> list:
+    nos = []
+    if "Relation Name" in plano:
+        nos.append(f"{plano['Node Type']} em {plano['Relation Name']}" + (f" ({plano['Index Name']})" if "Index Name" in plano else ""))
+    for filho in plano.get("Plans", []):
+        nos += scan_nodes(filho)
+    return nos
+
+## EXECUÇÃO ##
+
+async def run(args) -> int:
+    from tortoise import Tortoise, connections
+    from migrations import run_migrations
+
+    await Tortoise.init(db_url=args.db, modules={"models": ["database"]})
+    try:
+        connection = connections.get("default")
+        if connection.capabilities.dialect != "postgres":
+            print("Este teste depende do EXPLAIN do Postgres; use --db postgres://...")
+            return 2
+
+        await run_migrations()
+
+        if not args.sem_semear:
+            print(f"Semeando {args.usuarios} usuários, {args.submissoes} submissões e {args.submissoes * args.votos_por_submissao} votos...")
+            for comando in seed_sql(args.usuarios, args.desafios, args.submissoes, args.votos_por_submissao, args.referencias):
+                await connection.execute_script(comando)
+
+        falhas = 0
+        for nome, consulta in hot_queries(args.usuarios, args.desafios, args.submissoes).items():
+            _, linhas = await connection.execute_query(
+                f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {consulta.sql(params_inline=True)}"
+            )
+            resultado = linhas[0]["QUERY PLAN"]
+            if isinstance(resultado, str):
+                resultado = json.loads(resultado)
+            plano = resultado[0]
+
+            sequenciais = seq_scans(plano["Plan"])
+            falhas += bool(sequenciais)
+            situacao = f"FALHOU (Seq Scan em {', '.join(sequenciais)})" if sequenciais else "ok"
+            print(f"{nome:<45} {plano['Execution Time']:>9.2f} ms  {situacao}")
+            print(f"    {' -> '.join(scan_nodes(plano['Plan']))}")
+
+        print()
+        print("Todas as consultas quentes usam índice." if not falhas else f"{falhas} consultas sem índice.")
+        return 1 if falhas else 0
+    finally:
+        await Tortoise.close_connections()
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Semeia tabelas grandes e confere com EXPLAIN que as consultas quentes usam índice. Sai com 1 se alguma não usar."
+    )
+    parser.add_argument("--db", required=True, help="URL de um Postgres DESCARTÁVEL: as tabelas do bot são truncadas.")
+    parser.add_argument("--usuarios", type=int, default=100_000)
+    parser.add_argument("--desafios", type=int, default=500)
+    parser.add_argument("--submissoes", type=int, default=100_000)
+    parser.add_argument("--votos-por-submissao", type=int, default=10, help="Padrão: 1M votos com 100k submissões.")
+    parser.add_argument("--referencias", type=int, default=100, help="Rankings arquivados (1000 linhas cada).")
+    parser.add_argument("--sem-semear", action="store_true", help="Reaproveita os dados de uma execução anterior.")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(run(parse_args())))
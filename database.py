@@ -1,17 +1,35 @@
 import os
 from dotenv import load_dotenv
 from enum import Enum
-from tortoise import Tortoise, run_async, fields
+from tortoise import Tortoise, connections, run_async, fields
+from tortoise.indexes import Index
 from tortoise.models import Model
 
 load_dotenv()
 
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "2"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+# Cache de prepared statements do asyncpg, por conexão. 0 se houver um pgbouncer em modo transaction.
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "512"))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "30"))
+DB_CONNECT_TIMEOUT = float(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+DB_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_MAX_INACTIVE_LIFETIME", "300"))
+# Réplica de leitura opcional (mesmo usuário/banco) para consultas que aceitam um pequeno atraso.
+DB_REPLICA_HOST = os.getenv("DB_REPLICA_HOST")
+DB_REPLICA_PORT = os.getenv("DB_REPLICA_PORT", os.getenv("DB_PORT", 5432))
+
+class ConditionalIndex(Index):
+    # O PartialIndex do Tortoise só aceita condições de igualdade (sem IS NULL).
+    def __init__(self, *, fields: tuple, name: str, where: str):
+        super().__init__(fields=fields, name=name)
+        self.extra = f" WHERE {where}"
+
 class Usuario(Model):
     discord_id = fields.BigIntField(pk=True)
     username = fields.CharField(max_length=100)
-    pontos_total = fields.IntField(default=0)
-    pontos_semana = fields.IntField(default=0)
-    pontos_mes = fields.IntField(default=0)
+    pontos_total = fields.IntField(default=0, index=True)
+    pontos_semana = fields.IntField(default=0, index=True)
+    pontos_mes = fields.IntField(default=0, index=True)
 
     def __str__(self):
         return self.username
@@ -26,6 +44,7 @@ class Desafio(Model):
     class Status(str, Enum):
         ABERTO = "aberto"
         VOTACAO = "votacao"
+        APURACAO = "apuracao" # votação encerrada, pontos ainda não aplicados
         FECHADO = "fechado"
 
     id = fields.IntField(pk=True) 
@@ -55,8 +74,19 @@ class Submissao(Model):
     pontos_ia = fields.IntField(default=0)
     pontos_total = fields.IntField(default=0)
 
+    # Pré-avaliação da IA feita em segundo plano; None = ainda não avaliada (ou link alterado).
+    nota_ia = fields.IntField(null=True)
+    justificativa_ia = fields.TextField(null=True)
+    # Falhas da IA nessa submissão; ela só volta para a fila depois de proxima_tentativa_ia.
+    tentativas_ia = fields.IntField(default=0)
+    proxima_tentativa_ia = fields.DatetimeField(null=True)
+
     class Meta:
-        unique_together = ("desafio", "usuario")
+        unique_together = ("desafio", "usuario") # também atende Submissao.filter(desafio=...)
+        indexes = (
+            # Fila da pré-avaliação: só as ainda não avaliadas, as nunca tentadas primeiro.
+            ConditionalIndex(fields=("tentativas_ia", "data_submissao"), name="idx_submissao_fila_ia", where="nota_ia IS NULL"),
+        )
 
     def __str__(self):
         return f"Submissão {self.id} (Desafio: {self.desafio_id}, Usuário: {self.usuario_id})"
@@ -73,23 +103,136 @@ class Voto(Model):
     mensagem_id = fields.BigIntField(null=True) 
 
     class Meta:
-        unique_together = ("submissao", "usuario")
+        unique_together = ("submissao", "usuario") # também atende a busca por (submissao, usuario, tipo_voto)
+        indexes = (("mensagem_id", "usuario_id"),) # remoção de reação: (usuario, mensagem, tipo_voto)
 
     def __str__(self):
         return f"Voto de {self.usuario_id} em {self.submissao_id}"
     
+class AvaliacaoIA(Model):
+    chave = fields.CharField(max_length=64, pk=True) # sha256(código normalizado + desafio + versão do prompt + modelo)
+    modelo = fields.CharField(max_length=100)
+    nota = fields.IntField()
+    justificativa = fields.TextField()
+    criado_em = fields.DatetimeField(auto_now_add=True, index=True)
+
+    def __str__(self):
+        return f"Avaliação {self.chave[:12]} ({self.modelo}): {self.nota}"
+    
+class EstadoSistema(Model):
+    chave = fields.CharField(max_length=100, pk=True)
+    valor = fields.TextField()
+    atualizado_em = fields.DatetimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.chave}={self.valor}"
+
+class HistoricoRanking(Model):
+    id = fields.IntField(pk=True)
+    periodo = fields.CharField(max_length=10) # "semana" ou "mes"
+    referencia = fields.CharField(max_length=10) # ex: "2025-W07" ou "2025-02"
+    usuario = fields.ForeignKeyField('models.Usuario', related_name='historico_ranking')
+    username = fields.CharField(max_length=100)
+    pontos = fields.IntField()
+    posicao = fields.IntField()
+
+    class Meta:
+        unique_together = ("periodo", "referencia", "usuario")
+        indexes = (("periodo", "referencia", "posicao"),)
+
+    def __str__(self):
+        return f"{self.periodo} {self.referencia}: {self.posicao}º {self.username} ({self.pontos})"
+    
+class EventoPontuacao(Model):
+    class Tipo(str, Enum):
+        VOTO_ADICIONADO = "voto_adicionado"
+        VOTO_REMOVIDO = "voto_removido"
+        VOTO_JURADO = "voto_jurado"
+        NOTA_IA = "nota_ia"
+        PREMIACAO = "premiacao"
+        AJUSTE = "ajuste" # saldo inicial ou correção manual
+
+    # Ledger append-only: cada linha é o delta aplicado nos contadores.
+    id = fields.BigIntField(pk=True)
+    tipo = fields.CharEnumField(Tipo, max_length=20)
+    id_submissao = fields.IntField(null=True, index=True)
+    id_usuario = fields.BigIntField(null=True, index=True) # votante nos votos, premiado na premiação
+    delta_comunidade = fields.IntField(default=0)
+    delta_jurados = fields.IntField(default=0)
+    delta_ia = fields.IntField(default=0)
+    delta_usuario = fields.IntField(default=0) # Usuario.pontos_total
+    criado_em = fields.DatetimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Evento {self.id} ({self.tipo})"
+
+class SaldoLedgerSubmissao(Model):
+    id_submissao = fields.IntField(pk=True)
+    pontos_comunidade = fields.IntField(default=0)
+    pontos_jurados = fields.IntField(default=0)
+    pontos_ia = fields.IntField(default=0)
+
+class SaldoLedgerUsuario(Model):
+    id_usuario = fields.BigIntField(pk=True)
+    pontos_total = fields.IntField(default=0)
+    
+class Tarefa(Model):
+    # Fila de tarefas longas (encerrar votação, postar cédulas, gerar desafio).
+    class Tipo(str, Enum):
+        INICIAR_VOTACAO = "iniciar_votacao"
+        ENCERRAR_VOTACAO = "encerrar_votacao"
+        GERAR_DESAFIO = "gerar_desafio"
+
+    class Status(str, Enum):
+        PENDENTE = "pendente"
+        EXECUTANDO = "executando"
+        CONCLUIDA = "concluida"
+        FALHOU = "falhou"
+
+    id = fields.BigIntField(pk=True)
+    tipo = fields.CharEnumField(Tipo, max_length=20)
+    status = fields.CharEnumField(Status, max_length=10, default=Status.PENDENTE)
+    parametros = fields.JSONField(default=dict)
+    checkpoint = fields.JSONField(default=dict) # estado salvo pelo handler para retomar
+    progresso = fields.TextField(null=True)
+    erro = fields.TextField(null=True)
+    tentativas = fields.IntField(default=0)
+    dono = fields.CharField(max_length=100, null=True) # worker que está executando
+    bloqueada_ate = fields.DatetimeField(null=True) # lease: vencido, outro worker assume
+    disponivel_em = fields.DatetimeField(auto_now_add=True)
+    canal_id = fields.BigIntField(null=True) # mensagem de status editada com o progresso
+    mensagem_status_id = fields.BigIntField(null=True)
+    criado_em = fields.DatetimeField(auto_now_add=True)
+    atualizado_em = fields.DatetimeField(auto_now=True)
+
+    class Meta:
+        indexes = (("status", "disponivel_em"),)
+
+    def __str__(self):
+        return f"Tarefa {self.id} ({self.tipo}): {self.status}"
+
+def _conexao_postgres(host: str, port) -> dict:
+    return {
+        'engine': 'tortoise.backends.asyncpg',
+        'credentials': {
+            'host': host,
+            'port': port,
+            'user': os.getenv('DB_USER'),
+            'password': os.getenv('DB_PASS'),
+            'database': os.getenv('DB_NAME'),
+            'minsize': DB_POOL_MIN,
+            'maxsize': DB_POOL_MAX,
+            'statement_cache_size': DB_STATEMENT_CACHE_SIZE,
+            'command_timeout': DB_COMMAND_TIMEOUT,
+            'timeout': DB_CONNECT_TIMEOUT,
+            'max_inactive_connection_lifetime': DB_MAX_INACTIVE_LIFETIME,
+        },
+    }
+
 DB_CONFIG = {
     'connections': {
-        'default': {
-            'engine': 'tortoise.backends.asyncpg',
-            'credentials': {
-                'host': os.getenv('DB_HOST'),
-                'port': os.getenv('DB_PORT', 5432),
-                'user': os.getenv('DB_USER'),
-                'password': os.getenv('DB_PASS'),
-                'database': os.getenv('DB_NAME'),
-            },
-        }
+        'default': _conexao_postgres(os.getenv('DB_HOST'), os.getenv('DB_PORT', 5432)),
+        **({'replica': _conexao_postgres(DB_REPLICA_HOST, DB_REPLICA_PORT)} if DB_REPLICA_HOST else {}),
     },
     'apps': {
         'models': {
@@ -102,9 +245,30 @@ DB_CONFIG = {
 async def init_db():
     print("Inicializando Tortoise...")
     await Tortoise.init(config=DB_CONFIG)
-    
-    await Tortoise.generate_schemas()
-    print("Banco de dados conectado e schemas gerados.")
+
+    # O pool só é criado na primeira query; abre as DB_POOL_MIN conexões agora, não no primeiro comando.
+    for nome in DB_CONFIG['connections']:
+        await connections.get(nome).execute_query("SELECT 1")
+
+    # O schema é criado/atualizado pelas migrações (migrations.py), não a cada conexão.
+    print(f"Banco de dados conectado (pool {DB_POOL_MIN}-{DB_POOL_MAX}, réplica: {DB_REPLICA_HOST or 'não'}).")
+
+def read_connection():
+    # Consultas só de leitura que toleram alguns ms de atraso vão para a réplica, se houver.
+    return connections.get("replica" if DB_REPLICA_HOST else "default")
+
+def padded(valores) -> list:
+    # Completa listas de IN (...) até a próxima potência de 2 repetindo o último valor: o SQL
+    # gerado passa a ter poucas formas e o cache de prepared statements do asyncpg as reaproveita.
+    valores = list(valores)
+    tamanho = 1
+    while tamanho < len(valores):
+        tamanho *= 2
+    return valores + valores[-1:] * (tamanho - len(valores))
+
+def sql_param(connection, posicao: int) -> str:
+    # Placeholder de parâmetro para SQL cru: $1 no asyncpg, ? nos demais (ex: sqlite nos testes de carga).
+    return f"${posicao}" if connection.capabilities.dialect == "postgres" else "?"
 
 async def close_db():
     await Tortoise.close_connections()
\ No newline at end of file
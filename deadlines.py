@@ -0,0 +1,98 @@
+import os
+import heapq
+import asyncio
+import datetime
+
+from database import Desafio
+
+# Desafios criados por outro processo (ex: /gerar-desafio-ia no worker.py) entram
+# no heap na próxima releitura do banco; o prazo deles costuma ser de dias.
+DEADLINE_RESYNC_SECONDS = float(os.getenv("DEADLINE_RESYNC_SECONDS", "300"))
+
+def _agora() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+## AGENDADOR DE PRAZOS ##
+# Min-heap de (data_fim_submissao, desafio_id) dos desafios ABERTOS. A task dorme
+# até o prazo mais próximo (ou até um novo desafio com prazo menor chegar) e
+# chama on_deadline para cada desafio vencido. Agendar custa O(log n); entradas
+# de desafios que mudaram de prazo ou saíram do ABERTO ficam no heap e são
+# descartadas quando chegam ao topo.
+
+class DeadlineScheduler:
+    def __init__(self):
+        self.on_deadline = None
+        self._heap = []
+        self._prazos = {} # desafio_id -> prazo vigente (o que vale no heap)
+        self._acordar = asyncio.Event()
+        self._task = None
+
+    def schedule(self, desafio_id: int, prazo: datetime.datetime):
+        if self._prazos.get(desafio_id) == prazo:
+            return
+        self._prazos[desafio_id] = prazo
+        heapq.heappush(self._heap, (prazo, desafio_id))
+        # Só precisa acordar a task se o novo prazo passou a ser o mais próximo.
+        if self._heap[0] == (prazo, desafio_id):
+            self._acordar.set()
+
+    async def load(self):
+        abertos = await Desafio.filter(status=Desafio.Status.ABERTO).values_list("id", "data_fim_submissao")
+        for desafio_id, prazo in abertos:
+            self.schedule(desafio_id, prazo)
+        return len(abertos)
+
+    def _vencidos(self) -> list:
+        agora = _agora()
+        vencidos = []
+        while self._heap and self._heap[0][0] <= agora:
+            prazo, desafio_id = heapq.heappop(self._heap)
+            if self._prazos.get(desafio_id) == prazo:
+                del self._prazos[desafio_id]
+                vencidos.append(desafio_id)
+        return vencidos
+
+    async def _loop(self):
+        proxima_releitura = asyncio.get_running_loop().time() + DEADLINE_RESYNC_SECONDS
+        while True:
+            for desafio_id in self._vencidos():
+                try:
+                    await self.on_deadline(desafio_id)
+                except Exception as e:
+                    print(f"[PRAZOS] Falha ao encerrar as submissões do desafio {desafio_id}: {e}")
+
+            loop = asyncio.get_running_loop()
+            if loop.time() >= proxima_releitura:
+                try:
+                    await self.load()
+                except Exception as e:
+                    print(f"[PRAZOS] Falha ao reler os desafios abertos: {e}")
+                proxima_releitura = loop.time() + DEADLINE_RESYNC_SECONDS
+
+            espera = proxima_releitura - loop.time()
+            if self._heap:
+                espera = min(espera, (self._heap[0][0] - _agora()).total_seconds())
+
+            self._acordar.clear()
+            if espera > 0:
+                try:
+                    await asyncio.wait_for(self._acordar.wait(), espera)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def start(self, on_deadline):
+        if self._task is not None:
+            return
+        self.on_deadline = on_deadline
+        abertos = await self.load()
+        self._task = asyncio.create_task(self._loop())
+        proximo = f", próximo em {self._heap[0][0].astimezone(datetime.timezone.utc):%Y-%m-%d %H:%M} UTC" if self._heap else ""
+        print(f"[PRAZOS] Acompanhando o prazo de {abertos} desafios abertos{proximo}.")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+deadline_scheduler = DeadlineScheduler()
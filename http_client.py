@@ -0,0 +1,119 @@
+import os
+import time
+import aiohttp
+
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "60"))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+
+_session = None
+
+_stats = {
+    "requisicoes": 0,
+    "em_andamento": 0,
+    "pico_em_andamento": 0,
+    "erros": 0,
+    "conexoes_criadas": 0,
+    "conexoes_reutilizadas": 0,
+    "esperas_no_pool": 0,
+    "tempo_espera_no_pool": 0.0,
+    "dns_cache_hits": 0,
+    "dns_cache_misses": 0,
+}
+
+## ESTATÍSTICAS DO POOL (via TraceConfig do aiohttp) ##
+
+async def _on_request_start(session, ctx, params):
+    _stats["requisicoes"] += 1
+    _stats["em_andamento"] += 1
+    _stats["pico_em_andamento"] = max(_stats["pico_em_andamento"], _stats["em_andamento"])
+
+async def _on_request_end(session, ctx, params):
+    _stats["em_andamento"] -= 1
+
+async def _on_request_exception(session, ctx, params):
+    _stats["em_andamento"] -= 1
+    _stats["erros"] += 1
+
+async def _on_connection_create_end(session, ctx, params):
+    _stats["conexoes_criadas"] += 1
+
+async def _on_connection_reuseconn(session, ctx, params):
+    _stats["conexoes_reutilizadas"] += 1
+
+async def _on_connection_queued_start(session, ctx, params):
+    ctx.inicio_espera = time.monotonic()
+
+async def _on_connection_queued_end(session, ctx, params):
+    _stats["esperas_no_pool"] += 1
+    _stats["tempo_espera_no_pool"] += time.monotonic() - ctx.inicio_espera
+
+async def _on_dns_cache_hit(session, ctx, params):
+    _stats["dns_cache_hits"] += 1
+
+async def _on_dns_cache_miss(session, ctx, params):
+    _stats["dns_cache_misses"] += 1
+
+def _build_trace_config() -> aiohttp.TraceConfig:
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(_on_request_start)
+    trace.on_request_end.append(_on_request_end)
+    trace.on_request_exception.append(_on_request_exception)
+    trace.on_connection_create_end.append(_on_connection_create_end)
+    trace.on_connection_reuseconn.append(_on_connection_reuseconn)
+    trace.on_connection_queued_start.append(_on_connection_queued_start)
+    trace.on_connection_queued_end.append(_on_connection_queued_end)
+    trace.on_dns_cache_hit.append(_on_dns_cache_hit)
+    trace.on_dns_cache_miss.append(_on_dns_cache_miss)
+    return trace
+
+## CICLO DE VIDA DO CLIENTE ##
+
+def _create_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        use_dns_cache=True,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=None, connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT),
+        trace_configs=[_build_trace_config()],
+    )
+
+async def init_http():
+    global _session
+
+    if _session is None or _session.closed:
+        _session = _create_session()
+        print("Cliente HTTP compartilhado inicializado.")
+    return _session
+
+def get_session() -> aiohttp.ClientSession:
+    # Deve ser chamado de dentro do event loop. Se init_http ainda não rodou
+    # (ex: scripts avulsos), o cliente é criado sob demanda.
+    global _session
+
+    if _session is None or _session.closed:
+        _session = _create_session()
+    return _session
+
+async def close_http():
+    global _session
+
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+def http_pool_stats() -> dict:
+    stats = dict(_stats)
+    stats["limite_pool"] = HTTP_POOL_LIMIT
+    stats["limite_por_host"] = HTTP_POOL_LIMIT_PER_HOST
+    if stats["esperas_no_pool"]:
+        stats["espera_media_no_pool"] = stats["tempo_espera_no_pool"] / stats["esperas_no_pool"]
+    return stats
@@ -0,0 +1,185 @@
+import os
+import time
+import socket
+import asyncio
+import datetime
+from tortoise.expressions import Q
+from tortoise.transactions import in_transaction
+
+from database import Tarefa
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "5"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY_SECONDS = int(os.getenv("JOB_RETRY_DELAY_SECONDS", "30"))
+JOB_PROGRESS_INTERVAL = float(os.getenv("PROGRESS_EDIT_INTERVAL", "5"))
+
+## FILA DURÁVEL DE TAREFAS ##
+# Cada tarefa é uma linha em Tarefa. Um worker pega a próxima com SELECT ...
+# FOR UPDATE SKIP LOCKED (vários workers, em um ou mais processos, nunca pegam a
+# mesma) e mantém um lease renovado enquanto executa. Se o processo morrer, o
+# lease vence e outro worker retoma a tarefa a partir do checkpoint salvo.
+
+def _agora() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+class JobContext:
+    def __init__(self, fila, tarefa: Tarefa):
+        self._fila = fila
+        self.tarefa = tarefa
+        self._ultimo_relatorio = 0.0
+        self.lease_perdido = False
+
+    @property
+    def checkpoint(self) -> dict:
+        return self.tarefa.checkpoint
+
+    async def save_checkpoint(self, **dados):
+        self.tarefa.checkpoint.update(dados)
+        await Tarefa.filter(id=self.tarefa.id, dono=self.tarefa.dono).update(checkpoint=self.tarefa.checkpoint)
+
+    async def report(self, texto: str, forcar: bool = False):
+        # No máximo uma edição da mensagem de status a cada JOB_PROGRESS_INTERVAL.
+        agora = time.monotonic()
+        if not forcar and agora - self._ultimo_relatorio < JOB_PROGRESS_INTERVAL:
+            return
+        self._ultimo_relatorio = agora
+
+        self.tarefa.progresso = texto
+        await Tarefa.filter(id=self.tarefa.id).update(progresso=texto)
+        await self._fila.edit_status(self.tarefa, texto)
+
+class JobQueue:
+    def __init__(self):
+        self.handlers = {}
+        self.status_editor = None
+        self._workers = []
+        self._tipos = None
+        self._nova_tarefa = asyncio.Event()
+
+    def handler(self, tipo: Tarefa.Tipo):
+        def registrar(funcao):
+            self.handlers[tipo] = funcao
+            return funcao
+        return registrar
+
+    async def enqueue(self, tipo: Tarefa.Tipo, parametros: dict, canal_id: int = None, mensagem_status_id: int = None, connection=None) -> Tarefa:
+        # connection permite enfileirar na mesma transação da mudança que originou a tarefa.
+        tarefa = await Tarefa.create(
+            tipo=tipo, parametros=parametros, canal_id=canal_id, mensagem_status_id=mensagem_status_id, using_db=connection
+        )
+        self._nova_tarefa.set()
+        return tarefa
+
+    async def edit_status(self, tarefa: Tarefa, texto: str):
+        if self.status_editor is None or tarefa.mensagem_status_id is None:
+            return
+        try:
+            await self.status_editor(tarefa, texto)
+        except Exception as e:
+            print(f"[TAREFAS] Falha ao atualizar a mensagem de status da tarefa {tarefa.id}: {e}")
+
+    async def claim(self, dono: str):
+        agora = _agora()
+        async with in_transaction() as connection:
+            tarefa = await Tarefa.filter(
+                Q(status=Tarefa.Status.PENDENTE, disponivel_em__lte=agora)
+                | Q(status=Tarefa.Status.EXECUTANDO, bloqueada_ate__lt=agora),
+                tipo__in=list(self._tipos if self._tipos is not None else self.handlers)
+            ).order_by("id").select_for_update(skip_locked=True).using_db(connection).first()
+
+            if tarefa is None:
+                return None
+
+            tarefa.status = Tarefa.Status.EXECUTANDO
+            tarefa.dono = dono
+            tarefa.tentativas += 1
+            tarefa.bloqueada_ate = agora + datetime.timedelta(seconds=JOB_LEASE_SECONDS)
+            await tarefa.save(using_db=connection, update_fields=["status", "dono", "tentativas", "bloqueada_ate", "atualizado_em"])
+        return tarefa
+
+    async def _renovar_lease(self, tarefa: Tarefa, contexto: JobContext, execucao: asyncio.Task):
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            renovadas = await Tarefa.filter(id=tarefa.id, dono=tarefa.dono).update(
+                bloqueada_ate=_agora() + datetime.timedelta(seconds=JOB_LEASE_SECONDS)
+            )
+            if not renovadas:
+                print(f"[TAREFAS] Tarefa {tarefa.id} foi assumida por outro worker; interrompendo.")
+                contexto.lease_perdido = True
+                execucao.cancel()
+                return
+
+    async def _executar(self, tarefa: Tarefa):
+        contexto = JobContext(self, tarefa)
+        execucao = asyncio.create_task(self.handlers[tarefa.tipo](tarefa, contexto))
+        lease = asyncio.create_task(self._renovar_lease(tarefa, contexto, execucao))
+
+        try:
+            resultado = await execucao
+        except asyncio.CancelledError:
+            if contexto.lease_perdido:
+                return
+            # Desligando: devolve a tarefa para a fila sem esperar o lease vencer; o checkpoint fica.
+            await Tarefa.filter(id=tarefa.id, dono=tarefa.dono).update(status=Tarefa.Status.PENDENTE, bloqueada_ate=None)
+            raise
+        except Exception as e:
+            print(f"[TAREFAS] Tarefa {tarefa.id} ({tarefa.tipo.value}) falhou na tentativa {tarefa.tentativas}: {e}")
+            if tarefa.tentativas >= JOB_MAX_ATTEMPTS:
+                await Tarefa.filter(id=tarefa.id, dono=tarefa.dono).update(
+                    status=Tarefa.Status.FALHOU, erro=str(e), bloqueada_ate=None
+                )
+                await self.edit_status(tarefa, f"❌ Tarefa #{tarefa.id} falhou após {tarefa.tentativas} tentativas: {e}")
+            else:
+                await Tarefa.filter(id=tarefa.id, dono=tarefa.dono).update(
+                    status=Tarefa.Status.PENDENTE, erro=str(e), bloqueada_ate=None,
+                    disponivel_em=_agora() + datetime.timedelta(seconds=JOB_RETRY_DELAY_SECONDS * tarefa.tentativas)
+                )
+                await self.edit_status(tarefa, f"⚠️ Tarefa #{tarefa.id} falhou ({e}). Nova tentativa em breve...")
+            return
+        finally:
+            lease.cancel()
+
+        await Tarefa.filter(id=tarefa.id, dono=tarefa.dono).update(
+            status=Tarefa.Status.CONCLUIDA, progresso=resultado, bloqueada_ate=None
+        )
+        if resultado:
+            await self.edit_status(tarefa, resultado)
+
+    async def _worker(self, dono: str):
+        while True:
+            self._nova_tarefa.clear()
+            try:
+                tarefa = await self.claim(dono)
+            except Exception as e:
+                print(f"[TAREFAS] Erro ao buscar a próxima tarefa: {e}")
+                tarefa = None
+
+            if tarefa is None:
+                try:
+                    await asyncio.wait_for(self._nova_tarefa.wait(), JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            print(f"[TAREFAS] {dono} executando tarefa {tarefa.id} ({tarefa.tipo.value}), tentativa {tarefa.tentativas}.")
+            await self._executar(tarefa)
+
+    def start(self, quantidade: int = JOB_WORKERS, tipos: list = None):
+        # tipos limita o que este processo executa (ex: o gateway deixa as tarefas de IA para o worker.py).
+        # tipos=[] (ex: shard secundário com a IA no worker.py) = este processo não executa tarefas.
+        if self._workers or not quantidade or tipos == []:
+            return
+        self._tipos = tipos
+        prefixo = f"{socket.gethostname()}:{os.getpid()}"
+        self._workers = [asyncio.create_task(self._worker(f"{prefixo}:{numero}")) for numero in range(quantidade)]
+        print(f"[TAREFAS] {quantidade} workers da fila de tarefas iniciados.")
+
+    async def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+job_queue = JobQueue()
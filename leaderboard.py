@@ -0,0 +1,235 @@
+import os
+import bisect
+import datetime
+from zoneinfo import ZoneInfo
+from tortoise.transactions import in_transaction
+
+from database import EstadoSistema, HistoricoRanking, Usuario, read_connection, sql_param
+
+LEADERBOARD_BACKEND = os.getenv("LEADERBOARD_BACKEND", "local")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_KEY_PREFIX = os.getenv("REDIS_KEY_PREFIX", "codechallenge:ranking")
+RANKING_TIMEZONE = ZoneInfo(os.getenv("RANKING_TIMEZONE", "UTC"))
+
+# Período do /ranking -> coluna de pontos em Usuario.
+PERIODOS = {
+    "semana": "pontos_semana",
+    "mes": "pontos_mes",
+    "geral": "pontos_total",
+}
+
+PERIODOS_COM_RESET = ("semana", "mes")
+
+## BACKEND EM MEMÓRIA ##
+# Lista ordenada por (-pontos, discord_id) + dicionário de pontos por período.
+# Top-N e posição de um usuário são buscas binárias (O(log n)); atualizar um
+# usuário é um bisect + deslocamento da lista, que em memória é muito barato.
+
+class LocalLeaderboardBackend:
+    def __init__(self):
+        self._ordem = {periodo: [] for periodo in PERIODOS}
+        self._pontos = {periodo: {} for periodo in PERIODOS}
+        self._usernames = {}
+
+    async def replace(self, periodo: str, pontos_por_usuario: dict):
+        self._pontos[periodo] = dict(pontos_por_usuario)
+        self._ordem[periodo] = sorted((-pontos, discord_id) for discord_id, pontos in pontos_por_usuario.items())
+
+    async def incr(self, periodo: str, discord_id: int, delta: int) -> int:
+        ordem = self._ordem[periodo]
+        atual = self._pontos[periodo].get(discord_id)
+
+        if atual is not None:
+            del ordem[bisect.bisect_left(ordem, (-atual, discord_id))]
+
+        novo = (atual or 0) + delta
+        self._pontos[periodo][discord_id] = novo
+        bisect.insort(ordem, (-novo, discord_id))
+        return novo
+
+    async def top(self, periodo: str, limite: int, inicio: int = 0) -> list:
+        return [(discord_id, -pontos) for pontos, discord_id in self._ordem[periodo][inicio:inicio + limite]]
+
+    async def rank(self, periodo: str, discord_id: int):
+        pontos = self._pontos[periodo].get(discord_id)
+        if pontos is None:
+            return None
+        return bisect.bisect_left(self._ordem[periodo], (-pontos, discord_id)) + 1, pontos
+
+    async def count(self, periodo: str) -> int:
+        # Só quem tem pontos > 0 (as entradas são (-pontos, id), então param no primeiro (0, ...)).
+        return bisect.bisect_left(self._ordem[periodo], (0,))
+
+    async def set_usernames(self, usernames: dict):
+        self._usernames.update(usernames)
+
+    async def get_usernames(self, discord_ids: list) -> dict:
+        return {discord_id: self._usernames.get(discord_id) for discord_id in discord_ids}
+
+## BACKEND REDIS (SORTED SETS) ##
+# Opcional: só é importado com LEADERBOARD_BACKEND=redis. Permite que vários
+# processos do bot compartilhem o mesmo ranking. ZINCRBY/ZREVRANK são O(log n).
+
+class RedisLeaderboardBackend:
+    def __init__(self, url: str, prefixo: str):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url, decode_responses=True)
+        self._prefixo = prefixo
+
+    def _chave(self, periodo: str) -> str:
+        return f"{self._prefixo}:{periodo}"
+
+    async def replace(self, periodo: str, pontos_por_usuario: dict):
+        chave = self._chave(periodo)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.delete(chave)
+            if pontos_por_usuario:
+                pipe.zadd(chave, {str(discord_id): pontos for discord_id, pontos in pontos_por_usuario.items()})
+            await pipe.execute()
+
+    async def incr(self, periodo: str, discord_id: int, delta: int) -> int:
+        return int(await self._redis.zincrby(self._chave(periodo), delta, str(discord_id)))
+
+    async def top(self, periodo: str, limite: int, inicio: int = 0) -> list:
+        itens = await self._redis.zrevrange(self._chave(periodo), inicio, inicio + limite - 1, withscores=True)
+        return [(int(discord_id), int(pontos)) for discord_id, pontos in itens]
+
+    async def rank(self, periodo: str, discord_id: int):
+        chave = self._chave(periodo)
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.zrevrank(chave, str(discord_id))
+            pipe.zscore(chave, str(discord_id))
+            posicao, pontos = await pipe.execute()
+        if posicao is None:
+            return None
+        return posicao + 1, int(pontos)
+
+    async def count(self, periodo: str) -> int:
+        return await self._redis.zcount(self._chave(periodo), "(0", "+inf")
+
+    async def set_usernames(self, usernames: dict):
+        if usernames:
+            await self._redis.hset(f"{self._prefixo}:usernames", mapping={str(k): v for k, v in usernames.items()})
+
+    async def get_usernames(self, discord_ids: list) -> dict:
+        if not discord_ids:
+            return {}
+        nomes = await self._redis.hmget(f"{self._prefixo}:usernames", [str(discord_id) for discord_id in discord_ids])
+        return dict(zip(discord_ids, nomes))
+
+def create_backend():
+    if LEADERBOARD_BACKEND == "redis":
+        return RedisLeaderboardBackend(REDIS_URL, REDIS_KEY_PREFIX)
+    return LocalLeaderboardBackend()
+
+## RANKING MATERIALIZADO ##
+
+class Leaderboard:
+    def __init__(self, backend=None):
+        self.backend = backend or create_backend()
+        # Muda a cada alteração de pontos; usado para invalidar páginas já renderizadas.
+        self.versao = {periodo: 0 for periodo in PERIODOS}
+
+    async def load(self):
+        usuarios = await Usuario.all().values_list("discord_id", "username", *PERIODOS.values())
+
+        for indice, periodo in enumerate(PERIODOS):
+            await self.backend.replace(periodo, {linha[0]: linha[2 + indice] or 0 for linha in usuarios})
+        await self.backend.set_usernames({linha[0]: linha[1] for linha in usuarios})
+        for periodo in PERIODOS:
+            self.versao[periodo] += 1
+
+        print(f"[RANKING] Ranking carregado em memória com {len(usuarios)} usuários.")
+
+    async def add_points(self, discord_id: int, username: str, pontos: int):
+        await self.backend.set_usernames({discord_id: username})
+        for periodo in PERIODOS:
+            await self.backend.incr(periodo, discord_id, pontos)
+            self.versao[periodo] += 1
+
+    async def top(self, periodo: str, limite: int = 10, inicio: int = 0) -> list:
+        itens = await self.backend.top(periodo, limite, inicio)
+        nomes = await self.backend.get_usernames([discord_id for discord_id, _ in itens])
+        return [(discord_id, nomes.get(discord_id) or str(discord_id), pontos) for discord_id, pontos in itens]
+
+    async def rank(self, periodo: str, discord_id: int):
+        return await self.backend.rank(periodo, discord_id)
+
+    async def count(self, periodo: str) -> int:
+        return await self.backend.count(periodo)
+
+leaderboard = Leaderboard()
+
+## VIRADA DE SEMANA/MÊS ##
+# EstadoSistema guarda, por período, qual semana/mês está acumulando pontos.
+# Quando a data atual muda de período, o ranking que terminou é arquivado em
+# HistoricoRanking e a coluna é zerada, tudo em uma transação com um INSERT ...
+# SELECT e um UPDATE. Rodar de novo (ou após um restart) no mesmo período não
+# faz nada.
+
+def current_period_key(periodo: str, agora: datetime.datetime = None) -> str:
+    agora = agora or datetime.datetime.now(RANKING_TIMEZONE)
+
+    if periodo == "semana":
+        ano, semana, _ = agora.isocalendar()
+        return f"{ano}-W{semana:02d}"
+    return f"{agora.year}-{agora.month:02d}"
+
+async def reset_period(periodo: str) -> bool:
+    campo = PERIODOS[periodo]
+    atual = current_period_key(periodo)
+    chave_estado = f"reset_{periodo}"
+
+    async with in_transaction() as connection:
+        estado = await EstadoSistema.select_for_update().using_db(connection).get_or_none(chave=chave_estado)
+
+        if estado is None:
+            # Primeira execução: só marca o período atual, sem zerar nada.
+            await EstadoSistema.create(chave=chave_estado, valor=atual, using_db=connection)
+            return False
+
+        if estado.valor == atual:
+            return False
+
+        await connection.execute_query(
+            f"""
+            INSERT INTO {HistoricoRanking._meta.db_table} (periodo, referencia, usuario_id, username, pontos, posicao)
+            SELECT {sql_param(connection, 1)}, {sql_param(connection, 2)}, discord_id, username, {campo},
+                   ROW_NUMBER() OVER (ORDER BY {campo} DESC, discord_id)
+            FROM {Usuario._meta.db_table}
+            WHERE {campo} > 0
+            ON CONFLICT DO NOTHING
+            """,
+            [periodo, estado.valor]
+        )
+        await Usuario.filter(**{f"{campo}__gt": 0}).using_db(connection).update(**{campo: 0})
+
+        print(f"[RANKING] Ranking '{periodo}' de {estado.valor} arquivado e zerado (novo período: {atual}).")
+        estado.valor = atual
+        await estado.save(using_db=connection)
+
+    return True
+
+async def run_period_resets() -> bool:
+    houve_reset = False
+    for periodo in PERIODOS_COM_RESET:
+        houve_reset = await reset_period(periodo) or houve_reset
+
+    if houve_reset:
+        await leaderboard.load()
+    return houve_reset
+
+async def past_leaderboard(periodo: str, referencia: str = None, limite: int = 10):
+    # Rankings arquivados não mudam: podem vir da réplica.
+    connection = read_connection()
+    if referencia is None:
+        ultimo = await HistoricoRanking.filter(periodo=periodo).using_db(connection).order_by("-referencia").first()
+        if ultimo is None:
+            return None, []
+        referencia = ultimo.referencia
+
+    linhas = await HistoricoRanking.filter(
+        periodo=periodo, referencia=referencia
+    ).using_db(connection).order_by("posicao").limit(limite).values_list("posicao", "username", "pontos")
+    return referencia, linhas
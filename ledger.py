@@ -0,0 +1,250 @@
+import os
+import asyncio
+import datetime
+from tortoise.transactions import in_transaction
+
+from database import (
+    EstadoSistema,
+    EventoPontuacao,
+    SaldoLedgerSubmissao,
+    SaldoLedgerUsuario,
+    Submissao,
+    Usuario,
+    sql_param,
+)
+
+LEDGER_CHUNK_SIZE = int(os.getenv("LEDGER_CHUNK_SIZE", "5000"))
+# Eventos mais novos que isso ainda podem estar em transações abertas com id menor
+# que outros já gravados, então o checkpoint não passa por cima deles.
+LEDGER_SAFETY_SECONDS = int(os.getenv("LEDGER_SAFETY_SECONDS", "60"))
+
+CHAVE_CHECKPOINT = "ledger_checkpoint"
+CHAVE_INICIALIZADO = "ledger_inicializado"
+
+_lock_checkpoint = asyncio.Lock()
+
+## CRIAÇÃO DE EVENTOS ##
+
+def vote_event(tipo_voto: str, submissao_id: int, usuario_id: int, pontos: int) -> EventoPontuacao:
+    if tipo_voto == "jurado":
+        return EventoPontuacao(
+            tipo=EventoPontuacao.Tipo.VOTO_JURADO, id_submissao=submissao_id, id_usuario=usuario_id, delta_jurados=pontos
+        )
+
+    tipo = EventoPontuacao.Tipo.VOTO_ADICIONADO if pontos >= 0 else EventoPontuacao.Tipo.VOTO_REMOVIDO
+    return EventoPontuacao(tipo=tipo, id_submissao=submissao_id, id_usuario=usuario_id, delta_comunidade=pontos)
+
+def ai_score_event(submissao_id: int, delta: int) -> EventoPontuacao:
+    return EventoPontuacao(tipo=EventoPontuacao.Tipo.NOTA_IA, id_submissao=submissao_id, delta_ia=delta)
+
+def award_event(usuario_id: int, submissao_id: int, pontos: int) -> EventoPontuacao:
+    return EventoPontuacao(
+        tipo=EventoPontuacao.Tipo.PREMIACAO, id_submissao=submissao_id, id_usuario=usuario_id, delta_usuario=pontos
+    )
+
+async def append_events(eventos: list, connection=None):
+    # Sempre em lote; passe a conexão da transação que altera os contadores.
+    if eventos:
+        await EventoPontuacao.bulk_create(eventos, batch_size=LEDGER_CHUNK_SIZE, using_db=connection)
+
+## SALDO INICIAL ##
+
+async def bootstrap_ledger() -> bool:
+    # Na primeira vez, registra os pontos que já existiam como eventos de AJUSTE,
+    # para que o ledger bata com os contadores desde o início.
+    async with in_transaction() as connection:
+        estado = await EstadoSistema.select_for_update().using_db(connection).get_or_none(chave=CHAVE_INICIALIZADO)
+        if estado is not None:
+            return False
+
+        tabela = EventoPontuacao._meta.db_table
+        tipo = sql_param(connection, 1)
+
+        await connection.execute_query(
+            f"""
+            INSERT INTO {tabela} (tipo, id_submissao, delta_comunidade, delta_jurados, delta_ia, delta_usuario, criado_em)
+            SELECT {tipo}, id, pontos_comunidade, pontos_jurados, pontos_ia, 0, CURRENT_TIMESTAMP
+            FROM {Submissao._meta.db_table}
+            WHERE pontos_comunidade <> 0 OR pontos_jurados <> 0 OR pontos_ia <> 0
+            """,
+            [EventoPontuacao.Tipo.AJUSTE.value]
+        )
+        await connection.execute_query(
+            f"""
+            INSERT INTO {tabela} (tipo, id_usuario, delta_comunidade, delta_jurados, delta_ia, delta_usuario, criado_em)
+            SELECT {tipo}, discord_id, 0, 0, 0, pontos_total, CURRENT_TIMESTAMP
+            FROM {Usuario._meta.db_table}
+            WHERE pontos_total <> 0
+            """,
+            [EventoPontuacao.Tipo.AJUSTE.value]
+        )
+
+        await EstadoSistema.create(chave=CHAVE_INICIALIZADO, valor="1", using_db=connection)
+
+    print("[LEDGER] Saldo inicial dos pontos registrado no ledger.")
+    return True
+
+## AGREGAÇÃO INCREMENTAL ##
+
+def _chunks(itens: list, tamanho: int = LEDGER_CHUNK_SIZE):
+    for inicio in range(0, len(itens), tamanho):
+        yield itens[inicio:inicio + tamanho]
+
+async def _stream_events(desde_id: int, ate: datetime.datetime = None):
+    # Em ordem de id, parando no primeiro evento criado a partir de `ate`: quem chama
+    # guarda o último id devolvido como checkpoint, então nenhum id abaixo dele pode
+    # ficar de fora (filtrar por criado_em pularia eventos antigos com id maior).
+    ultimo = desde_id
+    while True:
+        lote = await EventoPontuacao.filter(id__gt=ultimo).order_by("id").limit(LEDGER_CHUNK_SIZE).values_list(
+            "id", "id_submissao", "id_usuario", "delta_comunidade", "delta_jurados", "delta_ia", "delta_usuario", "criado_em"
+        )
+        if not lote:
+            return
+
+        for *evento, criado_em in lote:
+            if ate is not None and criado_em >= ate:
+                return
+            yield evento
+        ultimo = lote[-1][0]
+
+async def _fold_events(desde_id: int, por_submissao: dict, por_usuario: dict, ate: datetime.datetime = None) -> int:
+    ultimo = desde_id
+
+    async for id_evento, id_submissao, id_usuario, comunidade, jurados, ia, usuario in _stream_events(desde_id, ate):
+        if id_submissao is not None and (comunidade or jurados or ia):
+            saldo = por_submissao.setdefault(id_submissao, [0, 0, 0])
+            saldo[0] += comunidade
+            saldo[1] += jurados
+            saldo[2] += ia
+        if id_usuario is not None and usuario:
+            por_usuario[id_usuario] = por_usuario.get(id_usuario, 0) + usuario
+        ultimo = id_evento
+
+    return ultimo
+
+async def _get_checkpoint(connection=None) -> int:
+    estado = await EstadoSistema.filter(chave=CHAVE_CHECKPOINT).using_db(connection).first()
+    return int(estado.valor) if estado else 0
+
+async def advance_checkpoint() -> int:
+    # Soma só os eventos novos desde o último checkpoint no saldo salvo.
+    async with _lock_checkpoint:
+        checkpoint = await _get_checkpoint()
+        limite = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=LEDGER_SAFETY_SECONDS)
+
+        por_submissao = {}
+        por_usuario = {}
+        ultimo = await _fold_events(checkpoint, por_submissao, por_usuario, ate=limite)
+
+        if ultimo == checkpoint:
+            return checkpoint
+
+        async with in_transaction() as connection:
+            for ids in _chunks(list(por_submissao)):
+                existentes = {
+                    saldo.id_submissao: saldo
+                    for saldo in await SaldoLedgerSubmissao.filter(id_submissao__in=ids).using_db(connection)
+                }
+                novos = []
+                for id_submissao in ids:
+                    comunidade, jurados, ia = por_submissao[id_submissao]
+                    saldo = existentes.get(id_submissao)
+                    if saldo is None:
+                        novos.append(SaldoLedgerSubmissao(
+                            id_submissao=id_submissao, pontos_comunidade=comunidade, pontos_jurados=jurados, pontos_ia=ia
+                        ))
+                    else:
+                        saldo.pontos_comunidade += comunidade
+                        saldo.pontos_jurados += jurados
+                        saldo.pontos_ia += ia
+
+                if novos:
+                    await SaldoLedgerSubmissao.bulk_create(novos, using_db=connection)
+                if existentes:
+                    await SaldoLedgerSubmissao.bulk_update(
+                        list(existentes.values()), fields=["pontos_comunidade", "pontos_jurados", "pontos_ia"], using_db=connection
+                    )
+
+            for ids in _chunks(list(por_usuario)):
+                existentes = {
+                    saldo.id_usuario: saldo
+                    for saldo in await SaldoLedgerUsuario.filter(id_usuario__in=ids).using_db(connection)
+                }
+                novos = []
+                for id_usuario in ids:
+                    saldo = existentes.get(id_usuario)
+                    if saldo is None:
+                        novos.append(SaldoLedgerUsuario(id_usuario=id_usuario, pontos_total=por_usuario[id_usuario]))
+                    else:
+                        saldo.pontos_total += por_usuario[id_usuario]
+
+                if novos:
+                    await SaldoLedgerUsuario.bulk_create(novos, using_db=connection)
+                if existentes:
+                    await SaldoLedgerUsuario.bulk_update(list(existentes.values()), fields=["pontos_total"], using_db=connection)
+
+            await EstadoSistema.update_or_create(chave=CHAVE_CHECKPOINT, defaults={"valor": str(ultimo)}, using_db=connection)
+
+        return ultimo
+
+## VERIFICAÇÃO ##
+
+async def _expected_totals():
+    checkpoint = await advance_checkpoint()
+
+    por_submissao = {
+        id_submissao: [comunidade, jurados, ia]
+        for id_submissao, comunidade, jurados, ia in await SaldoLedgerSubmissao.all().values_list(
+            "id_submissao", "pontos_comunidade", "pontos_jurados", "pontos_ia"
+        )
+    }
+    por_usuario = dict(await SaldoLedgerUsuario.all().values_list("id_usuario", "pontos_total"))
+
+    # Eventos depois do checkpoint (os mais recentes) entram direto na conta.
+    await _fold_events(checkpoint, por_submissao, por_usuario)
+    return por_submissao, por_usuario
+
+async def _stream_rows(model, chave: str, campos: tuple):
+    ultimo = None
+    while True:
+        consulta = model.all() if ultimo is None else model.filter(**{f"{chave}__gt": ultimo})
+        lote = await consulta.order_by(chave).limit(LEDGER_CHUNK_SIZE).values_list(chave, *campos)
+        if not lote:
+            return
+        for linha in lote:
+            yield linha
+        ultimo = lote[-1][0]
+
+async def verify_ledger(corrigir: bool = False) -> dict:
+    por_submissao, por_usuario = await _expected_totals()
+    divergencias = []
+    submissoes_verificadas = 0
+    usuarios_verificados = 0
+
+    campos_submissao = ("pontos_comunidade", "pontos_jurados", "pontos_ia", "pontos_total")
+    async for id_submissao, comunidade, jurados, ia, total in _stream_rows(Submissao, "id", campos_submissao):
+        submissoes_verificadas += 1
+        esperado = por_submissao.get(id_submissao, [0, 0, 0])
+        esperado = (esperado[0], esperado[1], esperado[2], sum(esperado))
+
+        if (comunidade, jurados, ia, total) != esperado:
+            divergencias.append(("submissao", id_submissao, (comunidade, jurados, ia, total), esperado))
+            if corrigir:
+                await Submissao.filter(id=id_submissao).update(**dict(zip(campos_submissao, esperado)))
+
+    # pontos_semana/pontos_mes são zerados a cada período, então só o total é conferido.
+    async for discord_id, total in _stream_rows(Usuario, "discord_id", ("pontos_total",)):
+        usuarios_verificados += 1
+        esperado = por_usuario.get(discord_id, 0)
+
+        if total != esperado:
+            divergencias.append(("usuario", discord_id, total, esperado))
+            if corrigir:
+                await Usuario.filter(discord_id=discord_id).update(pontos_total=esperado)
+
+    return {
+        "submissoes_verificadas": submissoes_verificadas,
+        "usuarios_verificados": usuarios_verificados,
+        "divergencias": divergencias,
+    }
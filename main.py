@@ -1,22 +1,69 @@
 import discord
 import os
+import json
+import math
+import asyncio
+import hashlib
 import datetime
 from discord.ext import tasks
 from discord import app_commands
 from discord.app_commands import Choice
 from dotenv import load_dotenv
+from tortoise.expressions import Q
 from tortoise.functions import Sum
-
-
-from ai_integration import fetch_code_from_url, generate_ai_challenge, get_ai_score
-from database import Submissao, Usuario, Voto, init_db, close_db, Desafio 
+from tortoise.transactions import in_transaction
+
+
+from ai_integration import (
+    PRE_SCORE_MAX_ATTEMPTS,
+    JudgingProgress,
+    generate_ai_challenge,
+    judge_submissions,
+    ollama_idle_slots,
+    pre_score_submission,
+    prune_score_cache,
+    store_submission_score,
+)
+from ballots import VoteButton, publish_ballots
+from database import Submissao, init_db, close_db, Desafio, EstadoSistema, Tarefa, read_connection
+from http_client import close_http, http_pool_stats, init_http
+from deadlines import deadline_scheduler
+from jobs import JobContext, job_queue
+from ledger import advance_checkpoint, bootstrap_ledger, verify_ledger
+from ollama_pool import ollama_pool
+from metrics import (
+    format_startup,
+    install_db_hooks,
+    medir,
+    operation_summary,
+    start_metrics_server,
+    startup_step,
+    stop_metrics_server,
+)
+from migrations import run_migrations
+from leaderboard import RANKING_TIMEZONE, leaderboard, past_leaderboard, run_period_resets
+from voting import EMOJI_VOTO, PONTOS_POR_VOTO_JURADO, apply_challenge_results, record_vote, vote_buffer, vote_index
+from user_cache import user_cache
 
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
-PONTOS_POR_VOTO_COMUNIDADE = 15
-PONTOS_POR_VOTO_JURADO = 30
+INTERVALO_PROGRESSO_SEGUNDOS = float(os.getenv("PROGRESS_EDIT_INTERVAL", "5"))
+INTERVALO_PRE_AVALIACAO_SEGUNDOS = float(os.getenv("PRE_SCORE_INTERVAL", "15"))
+# "local": este processo faz tudo. "remoto": análise da IA e geração de desafios
+# ficam com o worker.py (outro processo/máquina) e o gateway só roteia eventos.
+AI_WORKER_MODE = os.getenv("AI_WORKER_MODE", "local")
+# Vazios = o AutoShardedClient pede ao Discord o número recomendado de shards.
+DISCORD_SHARD_COUNT = os.getenv("DISCORD_SHARD_COUNT")
+DISCORD_SHARD_IDS = os.getenv("DISCORD_SHARD_IDS") # ex: "0,1" para dividir os shards entre processos
+if DISCORD_SHARD_IDS and not DISCORD_SHARD_COUNT:
+    # Sem o total não dá para saber qual processo tem o shard do servidor (GATEWAY_PRINCIPAL).
+    raise RuntimeError("DISCORD_SHARD_IDS exige DISCORD_SHARD_COUNT: defina o número total de shards em todos os processos.")
+FORCE_COMMAND_SYNC = os.getenv("FORCE_COMMAND_SYNC", "0") == "1"
+# Ao vencer o prazo de submissão, já posta as cédulas (0 = só fecha as submissões e espera o /iniciar-votacao).
+DEADLINE_AUTO_BALLOTS = os.getenv("DEADLINE_AUTO_BALLOTS", "1") == "1"
 
 NOME_CARGO_JURADO = "Jurado"
+ID_DO_CANAL_VOTACAO = int(os.getenv("DISCORD_VOTE_CHANNEL_ID"))
 
 CHALLENGE_CONFIG = {
         "iniciante": {
@@ -37,33 +84,222 @@ CHALLENGE_CONFIG = {
         }
     }
 
-ultimo_dia_checado = None
-ultima_semana_checada = None
-ultimo_mes_checado = None
-
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 
-client = discord.Client(intents=intents)
+client = discord.AutoShardedClient(
+    intents=intents,
+    shard_count=int(DISCORD_SHARD_COUNT) if DISCORD_SHARD_COUNT else None,
+    shard_ids=[int(shard) for shard in DISCORD_SHARD_IDS.split(",")] if DISCORD_SHARD_IDS else None
+)
 tree = app_commands.CommandTree(client)
 
 TEST_GUILD = discord.Object(id=int(os.getenv("DISCORD_SERVER_ID"))) 
 
+# Com os shards divididos entre processos, só o processo com o shard do servidor
+# sincroniza comandos, posta cédulas e roda as rotinas que não podem duplicar.
+GATEWAY_PRINCIPAL = not DISCORD_SHARD_IDS or (
+    (TEST_GUILD.id >> 22) % int(DISCORD_SHARD_COUNT) in {int(shard) for shard in DISCORD_SHARD_IDS.split(",")}
+)
+# No modo "local" só o processo principal fala com o Ollama (tarefas de IA e
+# pré-avaliação); os outros acompanham o resultado pelo banco, como no "remoto".
+IA_NESTE_PROCESSO = AI_WORKER_MODE != "remoto" and GATEWAY_PRINCIPAL
+
+
+## INICIALIZAÇÃO ##
+# Tudo que roda uma vez por processo fica em preparar_bot, chamado entre o login
+# e a conexão com o gateway. O on_ready dispara de novo a cada reconexão, então
+# só registra que o bot está online.
+
+async def sincronizar_comandos() -> bool:
+    # Só envia os comandos ao Discord quando a árvore mudou desde o último sync.
+    comandos = [comando.to_dict(tree) for comando in tree.get_commands(guild=TEST_GUILD)]
+    assinatura = hashlib.sha256(json.dumps(comandos, sort_keys=True).encode()).hexdigest()
+    chave = f"comandos_sincronizados:{client.application_id}:{TEST_GUILD.id}"
+
+    estado = await EstadoSistema.get_or_none(chave=chave)
+    if estado is not None and estado.valor == assinatura and not FORCE_COMMAND_SYNC:
+        return False
 
-@client.event
-async def on_ready():
-    
-    await init_db() 
-    
-    print(f'Bot {client.user} está online!')
     await tree.sync(guild=TEST_GUILD)
-    print('Comandos sincronizados.')
+    await EstadoSistema.update_or_create(chave=chave, defaults={"valor": assinatura})
+    return True
+
+async def preparar_bot():
+    tempos = []
+
+    with startup_step(tempos, "banco"):
+        await init_db()
+        install_db_hooks()
+    with startup_step(tempos, "migracoes"):
+        await run_migrations()
+    with startup_step(tempos, "http"):
+        await init_http()
+        ollama_pool.start()
+        await start_metrics_server()
+    with startup_step(tempos, "ledger"):
+        await bootstrap_ledger()
+    with startup_step(tempos, "votacao"):
+        await vote_index.load()
+        client.add_dynamic_items(VoteButton)
+        await vote_buffer.start()
+    with startup_step(tempos, "ranking"):
+        await leaderboard.load()
+        await run_period_resets()
+
+    job_queue.start(tipos=tarefas_do_gateway())
+    if IA_NESTE_PROCESSO:
+        pre_avaliar_submissoes.start()
+    else:
+        acompanhar_worker.start()
+
+    if GATEWAY_PRINCIPAL:
+        limpar_cache_avaliacoes.start()
+        virada_de_periodo.start()
+        checkpoint_ledger.start()
+
+        with startup_step(tempos, "prazos"):
+            await deadline_scheduler.start(encerrar_submissoes)
+        with startup_step(tempos, "comandos"):
+            if await sincronizar_comandos():
+                print('Comandos sincronizados.')
+            else:
+                print('Comandos sem alteração; sync ignorado.')
+
+    print(f"[INICIALIZAÇÃO] Pronto em {format_startup(tempos)}")
 
 @client.event
+@medir("on_ready")
+async def on_ready():
+    print(f'Bot {client.user} está online! Shards: {sorted(client.shards)}')
+
+@medir("on_shutdown")
 async def on_shutdown():
+    await deadline_scheduler.close()
+    await job_queue.close()
+    await vote_buffer.close()
+    await ollama_pool.close()
+    await stop_metrics_server()
+    await close_http()
     await close_db()
 
+## FILA DE TAREFAS ##
+# Operações longas de admin rodam na fila durável (jobs.py). O token da interação
+# expira em 15 minutos, então o progresso vai para uma mensagem no canal.
+
+# Tarefas que chamam o Ollama; no modo "remoto" só o worker.py as executa e no
+# "local" só o processo principal.
+TAREFAS_DE_IA = [Tarefa.Tipo.ENCERRAR_VOTACAO, Tarefa.Tipo.GERAR_DESAFIO]
+
+def tarefas_do_gateway() -> list:
+    tipos = [tipo for tipo in Tarefa.Tipo if IA_NESTE_PROCESSO or tipo not in TAREFAS_DE_IA]
+    if not GATEWAY_PRINCIPAL:
+        # As cédulas precisam ser registradas no vote_index de quem recebe as reações.
+        tipos = [tipo for tipo in tipos if tipo != Tarefa.Tipo.INICIAR_VOTACAO]
+    return tipos
+
+def obter_canal(canal_id: int):
+    # Fora do gateway (worker.py) não há cache de canais; a API REST basta para enviar e editar.
+    return client.get_channel(canal_id) or client.get_partial_messageable(canal_id)
+
+async def editar_status_tarefa(tarefa: Tarefa, texto: str):
+    await obter_canal(tarefa.canal_id).get_partial_message(tarefa.mensagem_status_id).edit(content=texto)
+
+job_queue.status_editor = editar_status_tarefa
+
+async def enfileirar_tarefa(interaction: discord.Interaction, tipo: Tarefa.Tipo, parametros: dict, texto_inicial: str):
+    mensagem = await interaction.channel.send(texto_inicial)
+    tarefa = await job_queue.enqueue(tipo, parametros, canal_id=mensagem.channel.id, mensagem_status_id=mensagem.id)
+    await interaction.followup.send(f"⏳ Tarefa #{tarefa.id} na fila. Acompanhe o progresso em {mensagem.jump_url}")
+
+async def tarefa_ativa(tipo: Tarefa.Tipo, desafio_id: int):
+    # Poucas tarefas ficam ativas ao mesmo tempo; o filtro pelo desafio é feito aqui.
+    ativas = await Tarefa.filter(tipo=tipo, status__in=[Tarefa.Status.PENDENTE, Tarefa.Status.EXECUTANDO])
+    return next((tarefa for tarefa in ativas if tarefa.parametros.get("desafio_id") == desafio_id), None)
+
+## TAREFAS EM SEGUNDO PLANO ##
+
+_ultimo_encerramento_remoto = None
+
+@tasks.loop(seconds=15)
+@medir("acompanhar_worker")
+async def acompanhar_worker():
+    # Quando a IA roda em outro processo (worker.py ou o gateway principal), os pontos
+    # de um desafio encerrado são somados lá; o ranking deste processo é recarregado
+    # do banco quando isso acontece.
+    global _ultimo_encerramento_remoto
+
+    try:
+        ultimo = await Tarefa.filter(
+            tipo=Tarefa.Tipo.ENCERRAR_VOTACAO, status=Tarefa.Status.CONCLUIDA
+        ).order_by("-atualizado_em").first().values_list("atualizado_em", flat=True)
+
+        if _ultimo_encerramento_remoto is None:
+            _ultimo_encerramento_remoto = ultimo or datetime.datetime.now(datetime.timezone.utc)
+        elif ultimo is not None and ultimo > _ultimo_encerramento_remoto:
+            _ultimo_encerramento_remoto = ultimo
+            await leaderboard.load()
+    except Exception as e:
+        print(f"[ERRO] Falha ao acompanhar as tarefas do worker: {e}")
+
+@tasks.loop(hours=12)
+@medir("limpar_cache_avaliacoes")
+async def limpar_cache_avaliacoes():
+    try:
+        removidas = await prune_score_cache()
+        if removidas:
+            print(f"[CACHE] {removidas} avaliações antigas removidas do cache de notas.")
+    except Exception as e:
+        print(f"[ERRO] Falha ao limpar cache de notas: {e}")
+
+@tasks.loop(seconds=INTERVALO_PRE_AVALIACAO_SEGUNDOS)
+@medir("pre_avaliar_submissoes")
+async def pre_avaliar_submissoes():
+    # Usa só a capacidade ociosa do Ollama, para não disputar com o /encerrar-votacao.
+    vagas = ollama_idle_slots()
+    if vagas == 0:
+        return
+
+    try:
+        # As que falharam há pouco esperam a vez; as nunca tentadas vêm antes delas.
+        agora = datetime.datetime.now(datetime.timezone.utc)
+        pendentes = await Submissao.filter(
+            Q(proxima_tentativa_ia=None) | Q(proxima_tentativa_ia__lte=agora),
+            nota_ia=None,
+            justificativa_ia=None,
+            tentativas_ia__lt=PRE_SCORE_MAX_ATTEMPTS,
+            desafio__status__in=[Desafio.Status.ABERTO, Desafio.Status.VOTACAO]
+        ).using_db(read_connection()).prefetch_related('desafio').order_by('tentativas_ia', 'data_submissao').limit(vagas)
+
+        resultados = await asyncio.gather(
+            *(pre_score_submission(sub, sub.desafio.descricao) for sub in pendentes),
+            return_exceptions=True
+        )
+
+        for sub, resultado in zip(pendentes, resultados):
+            if isinstance(resultado, Exception):
+                print(f"[ERRO] Falha na pré-avaliação da submissão {sub.id}: {resultado}")
+
+    except Exception as e:
+        print(f"[ERRO] Falha ao buscar submissões para pré-avaliação: {e}")
+
+@tasks.loop(time=datetime.time(hour=0, minute=0, second=30, tzinfo=RANKING_TIMEZONE))
+@medir("virada_de_periodo")
+async def virada_de_periodo():
+    try:
+        await run_period_resets()
+    except Exception as e:
+        print(f"[ERRO] Falha ao zerar rankings semanal/mensal: {e}")
+
+@tasks.loop(minutes=10)
+@medir("checkpoint_ledger")
+async def checkpoint_ledger():
+    try:
+        await advance_checkpoint()
+    except Exception as e:
+        print(f"[ERRO] Falha ao avançar o checkpoint do ledger: {e}")
+
 ## INICIANDO COMANDOS ##
 
 ## CRIAR DESAFIO ##
@@ -86,6 +322,7 @@ async def on_shutdown():
     Choice(name='Sênior', value='senior'),
 ])
 @app_commands.checks.has_permissions(administrator=True)
+@medir("criar-desafio")
 async def criar_desafio(
     interaction: discord.Interaction,
     titulo: str,
@@ -112,58 +349,42 @@ async def criar_desafio(
         await interaction.followup.send(f"❌ Erro ao criar o desafio no banco de dados: {e}")
         return
 
-    CHALLENGE_CONFIG = {
-        "iniciante": {
-            "role_id": int(os.getenv("ROLE_ID_INICIANTE")),
-            "channel_id": int(os.getenv("DISCORD_CHANNEL_INICIANTE"))
-        },
-        "junior": {
-            "role_id": int(os.getenv("ROLE_ID_JUNIOR")),
-            "channel_id": int(os.getenv("DISCORD_CHANNEL_JUNIOR"))
-        },
-        "pleno": {
-            "role_id": int(os.getenv("ROLE_ID_PLENO")),
-            "channel_id": int(os.getenv("DISCORD_CHANNEL_PLENO")),
-        },
-        "senior": {
-            "role_id": int(os.getenv("ROLE_ID_SENIOR")),
-            "channel_id": int(os.getenv("DISCORD_CHANNEL_SENIOR")),
-        }
-    }
+    deadline_scheduler.schedule(novo_desafio.id, novo_desafio.data_fim_submissao)
+
+    try:
+        resposta = await anunciar_desafio(novo_desafio, nivel.name)
+    except Exception as e:
+        print(f"Erro ao anunciar desafio: {e}")
+        resposta = f"⚠️ Desafio criado no DB (ID: {novo_desafio.id}), mas falhei ao tentar anunciá-lo. Erro: {e}"
+
+    await interaction.followup.send(resposta)
 
-    nivel_key = nivel.value 
-    config = CHALLENGE_CONFIG.get(nivel_key)
+async def anunciar_desafio(desafio: Desafio, nivel_nome: str) -> str:
+    config = CHALLENGE_CONFIG.get(desafio.nivel.value)
 
     if not config:
-        await interaction.followup.send(f"⚠️ Desafio criado no DB (ID: {novo_desafio.id}), mas NENHUM canal/role foi configurado no CHALLENGE_CONFIG para o nível '{nivel_key}'.")
-        return
+        return f"⚠️ Desafio criado no DB (ID: {desafio.id}), mas NENHUM canal/role foi configurado no CHALLENGE_CONFIG para o nível '{desafio.nivel.value}'."
 
-    try:
-        canal_desafio = client.get_channel(config["channel_id"])
-        role_mention = f"<@&{config['role_id']}>"
-        
-        if canal_desafio:
-            embed = discord.Embed(
-                title=f"🚀 Novo Desafio: {titulo} (Nível: {nivel.name})",
-                description=descricao_formatada,
-                color=discord.Color.blue()
-            )
-            embed.add_field(
-                name="Prazo de Submissão",
-                value=f"Até <t:{int(data_fim.timestamp())}:F>"
-            )
-            embed.set_footer(text=f"ID do Desafio: {novo_desafio.id} | Use /submeter para participar!")
+    canal_desafio = obter_canal(config["channel_id"])
+    role_mention = f"<@&{config['role_id']}>"
 
-            await canal_desafio.send(content=f"{role_mention}, novo desafio disponível!", embed=embed)
-            
-            await interaction.followup.send(f"✅ Desafio '{titulo}' (ID: {novo_desafio.id}) criado com sucesso e anunciado em {canal_desafio.mention}!")
-        
-        else:
-            await interaction.followup.send(f"⚠️ Desafio criado no DB (ID: {novo_desafio.id}), mas não encontrei o canal com ID {config['channel_id']}. Verifique o CHALLENGE_CONFIG.")
+    if not canal_desafio:
+        return f"⚠️ Desafio criado no DB (ID: {desafio.id}), mas não encontrei o canal com ID {config['channel_id']}. Verifique o CHALLENGE_CONFIG."
 
-    except Exception as e:
-        print(f"Erro ao anunciar desafio: {e}")
-        await interaction.followup.send(f"⚠️ Desafio criado no DB (ID: {novo_desafio.id}), mas falhei ao tentar anunciá-lo. Erro: {e}")
+    embed = discord.Embed(
+        title=f"🚀 Novo Desafio: {desafio.titulo} (Nível: {nivel_nome})",
+        description=desafio.descricao,
+        color=discord.Color.blue()
+    )
+    embed.add_field(
+        name="Prazo de Submissão",
+        value=f"Até <t:{int(desafio.data_fim_submissao.timestamp())}:F>"
+    )
+    embed.set_footer(text=f"ID do Desafio: {desafio.id} | Use /submeter para participar!")
+
+    await canal_desafio.send(content=f"{role_mention}, novo desafio disponível!", embed=embed)
+
+    return f"✅ Desafio '{desafio.titulo}' (ID: {desafio.id}) criado com sucesso e anunciado em {canal_desafio.mention}!"
 
 @tree.error
 async def on_app_command_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
@@ -191,6 +412,7 @@ async def on_app_command_error(interaction: discord.Interaction, error: app_comm
     id_desafio="O ID numérico do desafio (veja no #canal-desafios)",
     link_codigo="O link para seu código (GitHub Gist, Pastebin, etc.)"
 )
+@medir("submeter")
 async def submeter(
     interaction: discord.Interaction,
     id_desafio: int,
@@ -209,11 +431,10 @@ async def submeter(
         await interaction.followup.send(f"❌ **Erro:** Este desafio não está mais aceitando submissões (Status: {desafio.status}).")
         return
 
+    # A mudança para VOTACAO é feita pelo deadline_scheduler no momento do prazo.
     agora = datetime.datetime.now(datetime.timezone.utc)
     if agora > desafio.data_fim_submissao:
         await interaction.followup.send("❌ **Erro:** O prazo para este desafio já encerrou.")
-        desafio.status = Desafio.Status.VOTACAO
-        await desafio.save()
         return
 
    
@@ -222,16 +443,16 @@ async def submeter(
         return
 
     try:
-        usuario_db, criado = await Usuario.get_or_create(
-            discord_id=interaction.user.id,
-            defaults={"username": interaction.user.name}
-        )
-        
-        
+        await user_cache.ensure(interaction.user.id, interaction.user.name)
+
+        # Zerar nota_ia/justificativa_ia invalida a pré-avaliação quando o link muda.
         submissao, criada = await Submissao.update_or_create(
             desafio=desafio,
-            usuario=usuario_db,
-            defaults={"link_codigo": link_codigo, "data_submissao": agora}
+            usuario_id=interaction.user.id,
+            defaults={
+                "link_codigo": link_codigo, "data_submissao": agora, "nota_ia": None, "justificativa_ia": None,
+                "tentativas_ia": 0, "proxima_tentativa_ia": None
+            }
         )
 
         if criada:
@@ -260,22 +481,23 @@ async def submeter(
 
 @app_commands.describe(id_desafio="O ID do desafio para abrir a votação.")
 @app_commands.checks.has_permissions(administrator=True)
+@medir("iniciar-votacao")
 async def iniciar_votacao(interaction: discord.Interaction, id_desafio: int):
     await interaction.response.defer(ephemeral=True)
 
-    canal_votacao = client.get_channel(int(os.getenv("DISCORD_VOTE_CHANNEL_ID")))
+    canal_votacao = client.get_channel(ID_DO_CANAL_VOTACAO)
     if not canal_votacao:
         await interaction.followup.send(f"❌ Erro: Não encontrei o canal de votação. Verifique o ID.")
         return
 
     try:
-        desafio = await Desafio.get(id=id_desafio).prefetch_related('submissoes__usuario')
+        desafio = await Desafio.get(id=id_desafio).prefetch_related('submissoes')
 
     except Exception:
         await interaction.followup.send(f"❌ Erro: Desafio com ID {id_desafio} não encontrado.")
         return
 
-    if desafio.status != Desafio.Status.ABERTO:
+    if desafio.status not in (Desafio.Status.ABERTO, Desafio.Status.VOTACAO):
         await interaction.followup.send(f"❌ Erro: Este desafio não está 'ABERTO'. Status atual: {desafio.status}.")
         return
         
@@ -283,101 +505,119 @@ async def iniciar_votacao(interaction: discord.Interaction, id_desafio: int):
          await interaction.followup.send(f"❌ Erro: Este desafio não tem nenhuma submissão para votar.")
          return
 
-    
-    desafio.status = Desafio.Status.VOTACAO
-    await desafio.save()
-    
-    await canal_votacao.send(f"--- 🗳️ VOTAÇÃO INICIADA: {desafio.titulo} 🗳️ ---")
-    
-    total_submissoes = len(desafio.submissoes)
-    await interaction.followup.send(f"✅ Votação iniciada! Postando {total_submissoes} submissões em {canal_votacao.mention}...")
+    # Em VOTACAO, uma postagem anterior foi interrompida (ou o prazo virou sozinho): continua dela.
+    retomando = desafio.status == Desafio.Status.VOTACAO
 
-    
-    for submissao in desafio.submissoes:
-        
-        username = submissao.usuario.username
+    if retomando:
+        # Duas tarefas postando as mesmas cédulas duplicariam cédulas e rodapé.
+        ativa = await tarefa_ativa(Tarefa.Tipo.INICIAR_VOTACAO, desafio.id)
+        if ativa is not None:
+            await interaction.followup.send(f"⚠️ As cédulas deste desafio já estão sendo postadas (tarefa #{ativa.id}).")
+            return
+        # Postagem já concluída (ex: pelo prazo, com DEADLINE_AUTO_BALLOTS): nada a retomar.
+        rodape = await EstadoSistema.exists(chave=f"rodape_votacao:{desafio.id}")
+        if rodape and all(submissao.mensagem_votacao_id is not None for submissao in desafio.submissoes):
+            await interaction.followup.send("⚠️ A votação deste desafio já foi iniciada e todas as cédulas foram postadas.")
+            return
+    else:
+        alterados = await Desafio.filter(id=desafio.id, status=Desafio.Status.ABERTO).update(status=Desafio.Status.VOTACAO)
+        if not alterados:
+            await interaction.followup.send("❌ Erro: A votação deste desafio já está sendo iniciada.")
+            return
 
-        embed = discord.Embed(
-            title=f"Solução de: {username}",
-            description=f"Link para o código: {submissao.link_codigo}",
-            color=discord.Color.gold()
-        )
-        embed.set_footer(text=f"ID da Submissão: {submissao.id}")
+    await enfileirar_tarefa(
+        interaction,
+        Tarefa.Tipo.INICIAR_VOTACAO,
+        {"desafio_id": desafio.id, "retomando": retomando},
+        f"🗳️ Postando as cédulas do desafio **{desafio.titulo}** em {canal_votacao.mention}..."
+    )
 
-        msg = await canal_votacao.send(embed=embed)
-        await msg.add_reaction("🌟")
+async def enviar_uma_vez(contexto: JobContext, canal, chave: str, texto: str):
+    # Cabeçalho e rodapé saem uma vez por desafio, venha a votação do comando ou do
+    # prazo (encerrar_submissoes), mesmo que a postagem seja retomada por outra tarefa.
+    if contexto.checkpoint.get(chave):
+        return
+    if not await EstadoSistema.exists(chave=chave):
+        await canal.send(texto)
+        await EstadoSistema.get_or_create(chave=chave, defaults={"valor": str(contexto.tarefa.id)})
+    await contexto.save_checkpoint(**{chave: True})
+
+@job_queue.handler(Tarefa.Tipo.INICIAR_VOTACAO)
+@medir("tarefa-iniciar-votacao")
+async def processar_iniciar_votacao(tarefa: Tarefa, contexto: JobContext):
+    canal_votacao = client.get_channel(ID_DO_CANAL_VOTACAO)
+    if not canal_votacao:
+        raise RuntimeError("canal de votação não encontrado")
+
+    desafio = await Desafio.get(id=tarefa.parametros["desafio_id"]).prefetch_related('submissoes__usuario')
+    pendentes = [submissao for submissao in desafio.submissoes if submissao.mensagem_votacao_id is None]
+
+    await enviar_uma_vez(contexto, canal_votacao, f"cabecalho_votacao:{desafio.id}", f"--- 🗳️ VOTAÇÃO INICIADA: {desafio.titulo} 🗳️ ---")
+
+    if pendentes:
+        await contexto.report(f"🗳️ Postando {len(pendentes)} cédulas do desafio **{desafio.titulo}**...", forcar=True)
+        # Depois da primeira tentativa, procura no canal cédulas enviadas mas não salvas.
+        retomando = tarefa.parametros.get("retomando") or tarefa.tentativas > 1
+        await publish_ballots(canal_votacao, desafio.id, desafio.submissoes, client.user.id, retomando=retomando)
+
+    await enviar_uma_vez(contexto, canal_votacao, f"rodape_votacao:{desafio.id}", "--- 🏁 Fim das submissões 🏁 ---")
+
+    return f"✅ Votação de **{desafio.titulo}** iniciada com {len(desafio.submissoes)} submissões em {canal_votacao.mention}."
+
+@medir("prazo-submissoes")
+async def encerrar_submissoes(desafio_id: int):
+    # Chamado pelo deadline_scheduler quando vence o data_fim_submissao. A virada de
+    # status e a tarefa das cédulas vão na mesma transação: se o processo cair no
+    # meio, nada acontece e o desafio é reagendado ao subir de novo.
+    async with in_transaction() as connection:
+        alterados = await Desafio.filter(
+            id=desafio_id,
+            status=Desafio.Status.ABERTO,
+            data_fim_submissao__lte=datetime.datetime.now(datetime.timezone.utc)
+        ).using_db(connection).update(status=Desafio.Status.VOTACAO)
+        if not alterados:
+            # Já foi para votação pelo /iniciar-votacao.
+            return
 
-        submissao.mensagem_votacao_id = msg.id
-        await submissao.save()
+        submissoes = await Submissao.filter(desafio_id=desafio_id).using_db(connection).count()
+        if DEADLINE_AUTO_BALLOTS and submissoes:
+            await job_queue.enqueue(
+                Tarefa.Tipo.INICIAR_VOTACAO,
+                {"desafio_id": desafio_id, "retomando": False},
+                connection=connection
+            )
 
-    await canal_votacao.send(f"--- 🏁 Fim das submissões 🏁 ---")
+    postando = " Postando as cédulas..." if DEADLINE_AUTO_BALLOTS and submissoes else ""
+    print(f"[PRAZOS] Prazo do desafio {desafio_id} encerrado com {submissoes} submissões.{postando}")
 
 ## EVENTOS DE REAÇÕES PARA VOTAÇÃO ##
 
 @client.event
+@medir("on_raw_reaction_add")
 async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
-    if str(payload.emoji) != "🌟" or payload.user_id == client.user.id:
+    if payload.channel_id != ID_DO_CANAL_VOTACAO or payload.emoji.name != EMOJI_VOTO:
         return
 
-    if payload.channel_id != int(os.getenv("DISCORD_VOTE_CHANNEL_ID")): 
+    if payload.user_id == client.user.id or vote_index.get(payload.message_id) is None:
         return
 
-    try:
-        submissao = await Submissao.get(mensagem_votacao_id=payload.message_id)
-        
-        usuario_votante, _ = await Usuario.get_or_create(
-            discord_id=payload.user_id,
-            defaults={"username": payload.member.name if payload.member else "Usuário Desconhecido"}
-        )
-
-        voto, foi_criado = await Voto.get_or_create(
-            submissao=submissao,
-            usuario=usuario_votante,
-            tipo_voto="comunidade",
-            defaults={"mensagem_id": payload.message_id} 
-        )
-
-        if foi_criado:
-            submissao.pontos_comunidade += PONTOS_POR_VOTO_COMUNIDADE
-            submissao.pontos_total += PONTOS_POR_VOTO_COMUNIDADE
-            await submissao.save()
-        else:
-            return
-        
-    except Exception as e:
-        print(f"[ERRO] Erro em on_raw_reaction_add: {e}")
+    # O voto vai para o buffer e é gravado em lote pelo vote_buffer.
+    vote_buffer.add(
+        payload.message_id,
+        payload.user_id,
+        payload.member.name if payload.member else "Usuário Desconhecido"
+    )
 
 @client.event
+@medir("on_raw_reaction_remove")
 async def on_raw_reaction_remove(payload: discord.RawReactionActionEvent):
-    if str(payload.emoji) != "🌟" or payload.user_id == client.user.id:
+    if payload.channel_id != ID_DO_CANAL_VOTACAO or payload.emoji.name != EMOJI_VOTO:
         return
 
-    if payload.channel_id != int(os.getenv("DISCORD_VOTE_CHANNEL_ID")):
+    if payload.user_id == client.user.id or vote_index.get(payload.message_id) is None:
         return
 
-    try:
-        voto_removido = await Voto.get(
-            usuario_id=payload.user_id,
-            mensagem_id=payload.message_id,
-            tipo_voto="comunidade"
-        ).prefetch_related('submissao')
-
-        submissao = voto_removido.submissao
-        submissao.pontos_comunidade -= PONTOS_POR_VOTO_COMUNIDADE
-        submissao.pontos_total -= PONTOS_POR_VOTO_COMUNIDADE
-        
-        if submissao.pontos_comunidade < 0:
-            submissao.pontos_comunidade = 0
-        if submissao.pontos_total < 0 and submissao.pontos_jurados == 0 and submissao.pontos_ia == 0:
-             submissao.pontos_total = 0 
-            
-        await submissao.save()
-        await voto_removido.delete()
-        
-        print(f"[SUCESSO] Voto removido para submissão {submissao.id}. Novos pontos: {submissao.pontos_total}")
-
-    except Exception as e:
-        print(f"[AVISO] Erro ao remover voto (provavelmente não existia ou já foi removido): {e}")
+    vote_buffer.remove(payload.message_id, payload.user_id)
 
 ## INICIAR VOTAÇÃO POR JURADO ##
 
@@ -388,6 +628,7 @@ async def on_raw_reaction_remove(payload: discord.RawReactionActionEvent):
 )
 @app_commands.describe(id_submissao="O ID da submissão (veja no canal #votacao)")
 @app_commands.checks.has_role(NOME_CARGO_JURADO) 
+@medir("votar-jurado")
 async def votar_jurado(interaction: discord.Interaction, id_submissao: int):
     await interaction.response.defer(ephemeral=True)
 
@@ -405,36 +646,13 @@ async def votar_jurado(interaction: discord.Interaction, id_submissao: int):
         await interaction.followup.send("❌ Erro: Você não pode votar na sua própria submissão.")
         return
         
-    jurado_db, _ = await Usuario.get_or_create(
-        discord_id=interaction.user.id,
-        defaults={"username": interaction.user.name}
-    )
-
-    
     try:
-        voto, criado = await Voto.get_or_create(
-            submissao=submissao,
-            usuario=jurado_db,
-            tipo_voto="jurado" 
-        )
+        criado = await record_vote(submissao.id, interaction.user.id, interaction.user.name, "jurado")
 
         if not criado:
             await interaction.followup.send("⚠️ Você já votou nesta submissão como jurado.")
             return
 
-        submissoes_vencedoras = sorted(submissao, key=lambda s: s.pontos_total, reverse=True)
-
-        for sub in submissoes_vencedoras:
-            usuario = sub.usuario
-            
-            pontos_ganhos = sub.pontos_total 
-            
-            usuario.pontos_total += pontos_ganhos
-            usuario.pontos_mes += pontos_ganhos
-            usuario.pontos_semana += pontos_ganhos
-            
-            await usuario.save()
-
         await interaction.followup.send(f"✅ Voto de jurado computado! (+{PONTOS_POR_VOTO_JURADO} pontos para a submissão {submissao.id}).")
 
     except Exception as e:
@@ -463,6 +681,12 @@ async def on_app_command_error(interaction: discord.Interaction, error: app_comm
 
 ## Encerra votação ##
 
+async def reportar_progresso(contexto: JobContext, progresso: JudgingProgress):
+    # Uma única edição da mensagem a cada INTERVALO_PROGRESSO_SEGUNDOS, em vez de uma por submissão.
+    while True:
+        await contexto.report(progresso.resumo(), forcar=True)
+        await asyncio.sleep(INTERVALO_PROGRESSO_SEGUNDOS)
+
 @tree.command(
     name="encerrar-votacao",
     description="Fecha a votação de um desafio e anuncia os vencedores.",
@@ -470,6 +694,7 @@ async def on_app_command_error(interaction: discord.Interaction, error: app_comm
 )
 @app_commands.describe(id_desafio="O ID do desafio para fechar.")
 @app_commands.checks.has_permissions(administrator=True)
+@medir("encerrar-votacao")
 async def encerrar_votacao(interaction: discord.Interaction, id_desafio: int):
     await interaction.response.defer(ephemeral=True) 
 
@@ -479,72 +704,99 @@ async def encerrar_votacao(interaction: discord.Interaction, id_desafio: int):
         await interaction.followup.send(f"❌ Erro: Desafio com ID {id_desafio} não encontrado.")
         return
 
-    if desafio.status != Desafio.Status.VOTACAO:
+    if desafio.status == Desafio.Status.VOTACAO:
+        # Só uma execução passa daqui; as outras veem o status já alterado.
+        alterados = await Desafio.filter(id=desafio.id, status=Desafio.Status.VOTACAO).update(status=Desafio.Status.APURACAO)
+        if not alterados:
+            await interaction.followup.send("❌ Erro: Este desafio já está sendo encerrado.")
+            return
+    elif desafio.status == Desafio.Status.APURACAO:
+        # Um encerramento anterior parou antes de aplicar os pontos; retoma daqui.
+        print(f"[APURAÇÃO] Retomando a apuração do desafio {desafio.id}.")
+    else:
         await interaction.followup.send(f"❌ Erro: Este desafio não está em 'VOTAÇÃO'. Status atual: {desafio.status}.")
         return
 
-    desafio.status = Desafio.Status.FECHADO
-    await desafio.save()
+    # Grava os votos que ainda estavam no buffer e para de aceitar reações. O flush vem
+    # antes: fora do índice, o buffer só acharia a cédula no banco, já fora de VOTACAO.
+    await vote_buffer.flush()
+    vote_index.close_challenge(desafio.id)
 
-    submissoes = await Submissao.filter(desafio=desafio).prefetch_related('usuario')
+    await enfileirar_tarefa(
+        interaction,
+        Tarefa.Tipo.ENCERRAR_VOTACAO,
+        {"desafio_id": desafio.id},
+        f"🏁 Votação de **{desafio.titulo}** encerrada. Aguardando a análise da IA..."
+    )
 
-    if not submissoes:
-        await interaction.followup.send(f"✅ Desafio {desafio.titulo} fechado. Não houveram submissões.")
-        return
+@job_queue.handler(Tarefa.Tipo.ENCERRAR_VOTACAO)
+@medir("tarefa-encerrar-votacao")
+async def processar_encerrar_votacao(tarefa: Tarefa, contexto: JobContext):
+    desafio = await Desafio.get(id=tarefa.parametros["desafio_id"])
 
-    await interaction.edit_original_response(content=f"Votação encerrada. Iniciando análise da IA para {len(submissoes)} submissões...")
-    
-    ## IA ##
+    # Pode ser outro processo: garante que nenhum voto do buffer local fique para trás.
+    await vote_buffer.flush()
+    vote_index.close_challenge(desafio.id)
 
-    justificativas_ia = {} 
+    if desafio.status == Desafio.Status.APURACAO:
+        submissoes = await Submissao.filter(desafio=desafio)
 
-    for sub in submissoes:
-        await interaction.edit_original_response(content=f"Analisando submissão {sub.id} de {sub.usuario.username}...")
-        
-        code_text = await fetch_code_from_url(sub.link_codigo)
-        
-        if not code_text:
-            print(f"Não foi possível buscar o código da submissão {sub.id} (Link: {sub.link_codigo})")
-            justificativas_ia[sub.id] = "Erro ao buscar o código do link."
-            continue 
+        # Cada nota da IA é salva assim que sai (checkpoint por submissão): numa
+        # nova tentativa, só o que faltou volta para o Ollama.
+        pre_avaliadas = [sub for sub in submissoes if sub.nota_ia is not None]
+        pendentes = [sub for sub in submissoes if sub.nota_ia is None]
 
-        nota, justificativa = await get_ai_score(code_text, desafio.descricao)
-        
-        sub.pontos_ia = nota
-        sub.pontos_total += nota
-        await sub.save()
-        
-        justificativas_ia[sub.id] = justificativa 
-        
-    await interaction.edit_original_response(content="Análise da IA completa! Calculando rankings...")
+        await contexto.report(
+            f"Votação encerrada. {len(pre_avaliadas)} submissões já avaliadas, iniciando análise da IA para {len(pendentes)}...",
+            forcar=True
+        )
 
-    ## IA ##
+        progresso = JudgingProgress(len(pendentes))
+        tarefa_progresso = asyncio.create_task(reportar_progresso(contexto, progresso))
 
-    submissoes_vencedoras = sorted(submissoes, key=lambda s: s.pontos_total, reverse=True)
+        try:
+            resultados = await judge_submissions(pendentes, desafio.descricao, progresso, on_result=store_submission_score)
+        finally:
+            tarefa_progresso.cancel()
 
-    for sub in submissoes_vencedoras:
-        usuario = sub.usuario
-        
-        pontos_ganhos = sub.pontos_total 
-        
-        usuario.pontos_total += pontos_ganhos
-        usuario.pontos_mes += pontos_ganhos
-        usuario.pontos_semana += pontos_ganhos
-        
-        await usuario.save()
+        for sub in pre_avaliadas:
+            resultados[sub.id] = (sub.nota_ia, sub.justificativa_ia)
+
+        print(f"[HTTP] Uso do pool após análise do desafio {desafio.id}: {http_pool_stats()}")
+        await contexto.report(f"Análise da IA completa!\n{progresso.resumo()}\nCalculando rankings...", forcar=True)
+
+        if await apply_challenge_results(desafio.id, resultados):
+            for sub in await Submissao.filter(desafio=desafio).prefetch_related('usuario'):
+                await leaderboard.add_points(sub.usuario.discord_id, sub.usuario.username, sub.pontos_total)
+
+    elif desafio.status != Desafio.Status.FECHADO:
+        return f"❌ Erro: O desafio {desafio.titulo} não está em apuração (Status: {desafio.status})."
+
+    # Pontos já aplicados (agora ou numa tentativa anterior); falta só o anúncio.
+    if contexto.checkpoint.get("anunciado"):
+        return f"✅ Desafio {desafio.titulo} fechado e vencedores anunciados."
+
+    resposta = await anunciar_resultado(desafio)
+    await contexto.save_checkpoint(anunciado=True)
+    return resposta
+
+async def anunciar_resultado(desafio: Desafio) -> str:
+    submissoes = await Submissao.filter(desafio=desafio).prefetch_related('usuario')
+    if not submissoes:
+        return f"✅ Desafio {desafio.titulo} fechado. Não houveram submissões."
+
+    submissoes_vencedoras = sorted(submissoes, key=lambda s: s.pontos_total, reverse=True)
 
-    
     challenge_level = desafio.nivel.value 
     config = CHALLENGE_CONFIG.get(challenge_level) 
 
     canal_anuncios = int(os.getenv("DISCORD_ANNOUNCEMENT_CHANNEL_ID"))
     
     if config:
-        canal_anuncios = client.get_channel(config["channel_id"])
+        canal_anuncios = obter_canal(config["channel_id"])
     
     if not canal_anuncios:
-        await interaction.followup.send(f"✅ Desafio fechado. (AVISO: Não encontrei o canal de anúncio para o nível '{challenge_level}' no CHALLENGE_CONFIG).")
-        return 
+        return f"✅ Desafio fechado. (AVISO: Não encontrei o canal de anúncio para o nível '{challenge_level}' no CHALLENGE_CONFIG)."
 
     embed = discord.Embed(
         title=f"🏆 Votação Encerrada: {desafio.titulo} 🏆",
@@ -554,50 +806,145 @@ async def encerrar_votacao(interaction: discord.Interaction, id_desafio: int):
 
     medalhas = ["🥇 1º Lugar", "🥈 2º Lugar", "🥉 3º Lugar"]
 
-    if not submissoes_vencedoras:
-        embed.add_field(name="Resultados Finais", value="Nenhuma submissão recebeu pontos.")
-    else:
-        for i, sub in enumerate(submissoes_vencedoras[:3]):
-            
-            field_name = medalhas[i] if i < len(medalhas) else f"**{i+1}º Lugar**"
-            
-            feedback_ia = justificativas_ia.get(sub.id, 'N/A')
-            if len(feedback_ia) > 500:
-                feedback_ia = feedback_ia[:500] + "..."
-
-            field_value = (
-                f"**Participante:** {sub.usuario.username}\n"
-                f"**Pontos Totais:** **{sub.pontos_total}**\n"
-                f"*(Comunidade: {sub.pontos_comunidade}, Jurados: {sub.pontos_jurados}, IA: {sub.pontos_ia})*\n"
-                f"**Feedback da IA:** *{feedback_ia}*\n"
-            )
-            
-            embed.add_field(name=field_name, value=field_value, inline=False)
+    for i, sub in enumerate(submissoes_vencedoras[:3]):
+        
+        field_name = medalhas[i] if i < len(medalhas) else f"**{i+1}º Lugar**"
+        
+        feedback_ia = sub.justificativa_ia or 'N/A'
+        if len(feedback_ia) > 500:
+            feedback_ia = feedback_ia[:500] + "..."
+
+        field_value = (
+            f"**Participante:** {sub.usuario.username}\n"
+            f"**Pontos Totais:** **{sub.pontos_total}**\n"
+            f"*(Comunidade: {sub.pontos_comunidade}, Jurados: {sub.pontos_jurados}, IA: {sub.pontos_ia})*\n"
+            f"**Feedback da IA:** *{feedback_ia}*\n"
+        )
+        
+        embed.add_field(name=field_name, value=field_value, inline=False)
 
     embed.set_footer(text="Parabéns aos vencedores! 🎉")
 
     role_mention = f"<@&{config['role_id']}>"
     await canal_anuncios.send(content=f"{role_mention} Confira os resultados!", embed=embed)
-    await interaction.followup.send(f"✅ Desafio fechado e vencedores anunciados em {canal_anuncios.mention}!")
+    return f"✅ Desafio fechado e vencedores anunciados em {canal_anuncios.mention}!"
 
 ## FEAT DE RANKING GERAL ##
 
+TAMANHO_PAGINA_RANKING = 10
+
+# (periodo, pagina) -> (versão do leaderboard, embed); invalidado quando a versão muda.
+paginas_ranking = {}
+
+def titulo_do_ranking(tipo_ranking: str) -> str:
+    hoje = datetime.datetime.now() 
+
+    if tipo_ranking == 'semana':
+        return f"🏆 Ranking Semanal 🏆"
+    elif tipo_ranking == 'mes':
+        return f"🏆 Ranking Mensal ({hoje.strftime('%B de %Y')}) 🏆"
+    return "🏆 Ranking Geral (Todos os Tempos) 🏆"
+
+async def montar_pagina_ranking(tipo_ranking: str, pagina: int):
+    total_usuarios = await leaderboard.count(tipo_ranking)
+    total_paginas = max(math.ceil(total_usuarios / TAMANHO_PAGINA_RANKING), 1)
+    pagina = min(max(pagina, 0), total_paginas - 1)
+
+    versao = leaderboard.versao[tipo_ranking]
+    em_cache = paginas_ranking.get((tipo_ranking, pagina))
+    if em_cache and em_cache[0] == versao:
+        return em_cache[1], pagina, total_paginas
+
+    titulo_ranking = titulo_do_ranking(tipo_ranking)
+    inicio = pagina * TAMANHO_PAGINA_RANKING
+
+    top_usuarios = await leaderboard.top(tipo_ranking, TAMANHO_PAGINA_RANKING, inicio)
+
+    pontos_do_primeiro = 0
+    if top_usuarios:
+        pontos_do_primeiro = top_usuarios[0][2]
+
+    if not top_usuarios or pontos_do_primeiro == 0:
+        embed = discord.Embed(
+            title=titulo_ranking,
+            description="👻 Parece que está tudo zerado por aqui.\nNinguém pontuou ainda neste período.",
+            color=discord.Color.light_grey()
+        )
+    else:
+        embed = discord.Embed(
+            title=titulo_ranking,
+            description="Pontuação acumulada dos desafios.",
+            color=discord.Color.purple()
+        )
+
+        ranking_descricao = ""
+        medalhas = ["🥇", "🥈", "🥉"]
+
+        for i, (_, username, pontos) in enumerate(top_usuarios, start=inicio):
+            if pontos <= 0:
+                break
+            prefixo = medalhas[i] if i < len(medalhas) else f"**{i+1}.**"
+            ranking_descricao += f"{prefixo} {username} - **{pontos} pontos**\n"
+
+        nome_campo = "Top 10 Desenvolvedores" if pagina == 0 else f"Posições {inicio + 1} a {inicio + len(top_usuarios)}"
+        embed.add_field(name=nome_campo, value=ranking_descricao)
+
+    embed.set_footer(text=f"Página {pagina + 1} de {total_paginas}")
+
+    paginas_ranking[(tipo_ranking, pagina)] = (versao, embed)
+    return embed, pagina, total_paginas
+
+class RankingView(discord.ui.View):
+    def __init__(self, autor_id: int, tipo_ranking: str, pagina: int, total_paginas: int):
+        super().__init__(timeout=300)
+        self.autor_id = autor_id
+        self.tipo_ranking = tipo_ranking
+        self.pagina = pagina
+        self.total_paginas = total_paginas
+        self._atualizar_botoes()
+
+    def _atualizar_botoes(self):
+        self.anterior.disabled = self.pagina <= 0
+        self.proxima.disabled = self.pagina >= self.total_paginas - 1
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.autor_id:
+            await interaction.response.send_message("Use /ranking para navegar no seu próprio ranking.", ephemeral=True)
+            return False
+        return True
+
+    async def _mudar_pagina(self, interaction: discord.Interaction, pagina: int):
+        embed, self.pagina, self.total_paginas = await montar_pagina_ranking(self.tipo_ranking, pagina)
+        self._atualizar_botoes()
+        await interaction.response.edit_message(embed=embed, view=self)
+
+    @discord.ui.button(label="◀️ Anterior", style=discord.ButtonStyle.secondary)
+    async def anterior(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._mudar_pagina(interaction, self.pagina - 1)
+
+    @discord.ui.button(label="Próxima ▶️", style=discord.ButtonStyle.secondary)
+    async def proxima(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._mudar_pagina(interaction, self.pagina + 1)
+
 @tree.command(
     name="ranking",
     description="Mostra o ranking de pontos da comunidade.",
     guild=TEST_GUILD
 )
 @app_commands.describe(
-    periodo="O tipo de ranking que você quer ver (padrão: Semanal)."
+    periodo="O tipo de ranking que você quer ver (padrão: Semanal).",
+    pagina="A página do ranking (padrão: 1)."
 )
 @app_commands.choices(periodo=[
     Choice(name='Semanal (Esta Semana)', value='semana'),
     Choice(name='Mensal (Este Mês)', value='mes'),
     Choice(name='Geral (Todos os Tempos)', value='geral'),
 ])
+@medir("ranking")
 async def ranking(
     interaction: discord.Interaction, 
-    periodo: Choice[str] = None 
+    periodo: Choice[str] = None,
+    pagina: app_commands.Range[int, 1] = 1
 ):
     await interaction.response.defer()
 
@@ -605,59 +952,153 @@ async def ranking(
     if periodo:
         tipo_ranking = periodo.value
 
-    hoje = datetime.datetime.now() 
-    top_usuarios = []
-    titulo_ranking = ""
-    campo_pontos = "" 
+    embed, pagina_atual, total_paginas = await montar_pagina_ranking(tipo_ranking, pagina - 1)
 
-    if tipo_ranking == 'semana':
-        titulo_ranking = f"🏆 Ranking Semanal 🏆"
-        campo_pontos = 'pontos_semana'
-        
-    elif tipo_ranking == 'mes':
-        titulo_ranking = f"🏆 Ranking Mensal ({hoje.strftime('%B de %Y')}) 🏆"
-        campo_pontos = 'pontos_mes'
-
-    else: 
-        titulo_ranking = "🏆 Ranking Geral (Todos os Tempos) 🏆"
-        campo_pontos = 'pontos_total'
-        
-    top_usuarios = await Usuario.all().order_by(f'-{campo_pontos}').limit(10)
-
-
-    pontos_do_primeiro = 0
-    if top_usuarios:
-        pontos_do_primeiro = getattr(top_usuarios[0], campo_pontos) or 0 
-
-    if not top_usuarios or pontos_do_primeiro == 0:
-        embed = discord.Embed(
-            title=titulo_ranking,
-            description="👻 Parece que está tudo zerado por aqui.\nNinguém pontuou ainda neste período.",
-            color=discord.Color.light_grey()
-        )
+    if total_paginas > 1:
+        view = RankingView(interaction.user.id, tipo_ranking, pagina_atual, total_paginas)
+        await interaction.followup.send(embed=embed, view=view)
+    else:
         await interaction.followup.send(embed=embed)
-        return
+
+@tree.command(
+    name="meu-ranking",
+    description="Mostra a sua posição no ranking semanal, mensal e geral.",
+    guild=TEST_GUILD
+)
+@medir("meu-ranking")
+async def meu_ranking(interaction: discord.Interaction):
+    await interaction.response.defer(ephemeral=True)
 
     embed = discord.Embed(
-        title=titulo_ranking,
-        description="Pontuação acumulada dos desafios.",
+        title=f"📊 Posição de {interaction.user.name}",
         color=discord.Color.purple()
     )
 
-    ranking_descricao = ""
-    medalhas = ["🥇", "🥈", "🥉"]
+    nomes_periodos = {'semana': "Semanal", 'mes': "Mensal", 'geral': "Geral"}
 
-    for i, usuario in enumerate(top_usuarios):
-        pontos = getattr(usuario, campo_pontos) or 0
-        
-        prefixo = medalhas[i] if i < len(medalhas) else f"**{i+1}.**"
-        ranking_descricao += f"{prefixo} {usuario.username} - **{pontos} pontos**\n"
+    for tipo_ranking, nome in nomes_periodos.items():
+        posicao = await leaderboard.rank(tipo_ranking, interaction.user.id)
+        total = await leaderboard.count(tipo_ranking)
+
+        if posicao is None or posicao[1] <= 0:
+            valor = "Ainda sem pontos neste período."
+        else:
+            valor = f"**{posicao[0]}º** de {total} — **{posicao[1]} pontos**"
+
+        embed.add_field(name=nome, value=valor, inline=False)
+
+    await interaction.followup.send(embed=embed)
+
+@tree.command(
+    name="ranking-anterior",
+    description="Mostra o ranking final da semana ou do mês anterior.",
+    guild=TEST_GUILD
+)
+@app_commands.describe(periodo="Semana ou mês anterior (padrão: Semanal).")
+@app_commands.choices(periodo=[
+    Choice(name='Semana Anterior', value='semana'),
+    Choice(name='Mês Anterior', value='mes'),
+])
+@medir("ranking-anterior")
+async def ranking_anterior(interaction: discord.Interaction, periodo: Choice[str] = None):
+    await interaction.response.defer()
+
+    tipo_ranking = periodo.value if periodo else 'semana'
+    referencia, linhas = await past_leaderboard(tipo_ranking)
+
+    if not linhas:
+        await interaction.followup.send("👻 Ainda não há rankings arquivados para este período.")
+        return
+
+    medalhas = ["🥇", "🥈", "🥉"]
+    ranking_descricao = ""
+    for posicao, username, pontos in linhas:
+        prefixo = medalhas[posicao - 1] if posicao <= len(medalhas) else f"**{posicao}.**"
+        ranking_descricao += f"{prefixo} {username} - **{pontos} pontos**\n"
 
+    nome_periodo = "Semana" if tipo_ranking == 'semana' else "Mês"
+    embed = discord.Embed(
+        title=f"📜 Ranking Final — {nome_periodo} {referencia}",
+        color=discord.Color.dark_purple()
+    )
     embed.add_field(name="Top 10 Desenvolvedores", value=ranking_descricao)
     await interaction.followup.send(embed=embed)
 
 ##
 
+## FEAT DE AUDITORIA DE PONTOS ##
+
+@tree.command(
+    name="verificar-pontos",
+    description="Confere os pontos salvos contra o histórico de eventos (ledger).",
+    guild=TEST_GUILD
+)
+@app_commands.describe(corrigir="Se verdadeiro, reescreve os contadores divergentes a partir do ledger.")
+@app_commands.checks.has_permissions(administrator=True)
+@medir("verificar-pontos")
+async def verificar_pontos(interaction: discord.Interaction, corrigir: bool = False):
+    await interaction.response.defer(ephemeral=True)
+
+    try:
+        resultado = await verify_ledger(corrigir=corrigir)
+    except Exception as e:
+        print(f"Erro ao verificar ledger: {e}")
+        await interaction.followup.send(f"❌ Erro ao verificar os pontos: {e}")
+        return
+
+    divergencias = resultado["divergencias"]
+    resumo = (
+        f"🔎 {resultado['submissoes_verificadas']} submissões e {resultado['usuarios_verificados']} usuários verificados.\n"
+    )
+
+    if not divergencias:
+        await interaction.followup.send(resumo + "✅ Todos os contadores batem com o ledger.")
+        return
+
+    linhas = []
+    for entidade, identificador, salvo, esperado in divergencias[:10]:
+        linhas.append(f"- {entidade} `{identificador}`: salvo {salvo}, ledger {esperado}")
+    if len(divergencias) > 10:
+        linhas.append(f"... e mais {len(divergencias) - 10}.")
+
+    if corrigir:
+        await leaderboard.load()
+        resumo += f"🛠️ {len(divergencias)} divergências corrigidas a partir do ledger:\n"
+    else:
+        resumo += f"⚠️ {len(divergencias)} divergências encontradas (use `corrigir: True` para corrigir):\n"
+
+    await interaction.followup.send(resumo + "\n".join(linhas))
+
+## FEAT DE MÉTRICAS ##
+
+@tree.command(
+    name="stats",
+    description="Mostra tempo, queries e uso do Ollama por comando desde que o bot iniciou.",
+    guild=TEST_GUILD
+)
+@app_commands.checks.has_permissions(administrator=True)
+async def stats(interaction: discord.Interaction):
+    resumo = operation_summary()
+
+    if not resumo:
+        await interaction.response.send_message("Nenhuma operação medida ainda.", ephemeral=True)
+        return
+
+    embed = discord.Embed(title="📊 Desempenho por operação", color=discord.Color.blurple())
+    for linha in resumo[:25]:
+        embed.add_field(
+            name=f"{linha['nome']} ({linha['chamadas']}x)",
+            value=(
+                f"p50 ≤ {linha['p50']:g}s · p95 ≤ {linha['p95']:g}s · total {linha['tempo_total']:.1f}s\n"
+                f"{linha['queries_media']:.1f} queries/chamada · banco {linha['db_media'] * 1000:.0f}ms · "
+                f"Ollama {linha['ollama_media']:.1f}s"
+            ),
+            inline=False
+        )
+    embed.set_footer(text="Histogramas completos em /metrics (formato Prometheus).")
+
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
 ## FEAT DE GERAR DESAFIOS COM IA ##
 
 @tree.command(
@@ -676,6 +1117,7 @@ async def ranking(
     Choice(name='Sênior', value='senior'),
 ])
 @app_commands.checks.has_permissions(administrator=True)
+@medir("gerar-desafio-ia")
 async def gerar_desafio_ia(
     interaction: discord.Interaction,
     tema: str,
@@ -683,81 +1125,51 @@ async def gerar_desafio_ia(
     dias_para_concluir: int
 ):
     await interaction.response.defer(ephemeral=True) 
-    
-    titulo, descricao = await generate_ai_challenge(nivel.value, tema)
-    
-    if not titulo or not descricao:
-        await interaction.followup.send(f"❌ Erro ao gerar desafio com IA: {descricao}")
-        return
 
-    
-    data_fim = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=dias_para_concluir)
+    await enfileirar_tarefa(
+        interaction,
+        Tarefa.Tipo.GERAR_DESAFIO,
+        {"tema": tema, "nivel": nivel.value, "nivel_nome": nivel.name, "dias": dias_para_concluir},
+        f"🤖 Gerando um desafio de nível {nivel.name} sobre **{tema}**..."
+    )
 
-    try:
+@job_queue.handler(Tarefa.Tipo.GERAR_DESAFIO)
+@medir("tarefa-gerar-desafio")
+async def processar_gerar_desafio(tarefa: Tarefa, contexto: JobContext):
+    parametros = tarefa.parametros
+
+    # O desafio só é criado uma vez, mesmo que o anúncio falhe e a tarefa rode de novo.
+    desafio_id = contexto.checkpoint.get("desafio_id")
+    if desafio_id is None:
+        titulo, descricao = await generate_ai_challenge(parametros["nivel"], parametros["tema"])
+        if not titulo or not descricao:
+            raise RuntimeError(f"Erro ao gerar desafio com IA: {descricao}")
+
+        data_fim = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=parametros["dias"])
         novo_desafio = await Desafio.create(
             titulo=titulo,
             descricao=descricao,
-            nivel=nivel.value,
+            nivel=parametros["nivel"],
             data_fim_submissao=data_fim
         )
-    except Exception as e:
-        await interaction.followup.send(f"❌ Erro ao salvar o desafio da IA no banco de dados: {e}")
-        return
-
-
-    CHALLENGE_CONFIG = {
-        "iniciante": {
-            "role_id": int(os.getenv("ROLE_ID_INICIANTE")),
-            "channel_id": int(os.getenv("DISCORD_CHANNEL_INICIANTE"))
-        },
-        "junior": {
-            "role_id": int(os.getenv("ROLE_ID_JUNIOR")),
-            "channel_id": int(os.getenv("DISCORD_CHANNEL_JUNIOR"))
-        },
-        "pleno": {
-            "role_id": int(os.getenv("ROLE_ID_PLENO")),
-            "channel_id": int(os.getenv("DISCORD_CHANNEL_PLENO")),
-        },
-        "senior": {
-            "role_id": int(os.getenv("ROLE_ID_SENIOR")),
-            "channel_id": int(os.getenv("DISCORD_CHANNEL_SENIOR")),
-        }
-    }
-
-    nivel_key = nivel.value 
-    config = CHALLENGE_CONFIG.get(nivel_key)
-
-    if not config:
-        await interaction.followup.send(f"⚠️ Desafio criado no DB (ID: {novo_desafio.id}), mas NENHUM canal/role foi configurado no CHALLENGE_CONFIG para o nível '{nivel_key}'.")
-        return
-
-    try:
-        canal_desafio = client.get_channel(config["channel_id"])
-        role_mention = f"<@&{config['role_id']}>"
-        
-        if canal_desafio:
-            embed = discord.Embed(
-                title=f"🚀 Novo Desafio: {titulo} (Nível: {nivel.name})",
-                description=descricao,
-                color=discord.Color.blue()
-            )
-            embed.add_field(
-                name="Prazo de Submissão",
-                value=f"Até <t:{int(data_fim.timestamp())}:F>"
-            )
-            embed.set_footer(text=f"ID do Desafio: {novo_desafio.id} | Use /submeter para participar!")
-
-            await canal_desafio.send(content=f"{role_mention}, novo desafio disponível!", embed=embed)
-            
-            await interaction.followup.send(f"✅ Desafio '{titulo}' (ID: {novo_desafio.id}) criado com sucesso e anunciado em {canal_desafio.mention}!")
-        
-        else:
-            await interaction.followup.send(f"⚠️ Desafio criado no DB (ID: {novo_desafio.id}), mas não encontrei o canal com ID {config['channel_id']}. Verifique o CHALLENGE_CONFIG.")
+        await contexto.save_checkpoint(desafio_id=novo_desafio.id)
+        deadline_scheduler.schedule(novo_desafio.id, novo_desafio.data_fim_submissao)
+    else:
+        novo_desafio = await Desafio.get(id=desafio_id)
 
-    except Exception as e:
-        print(f"Erro ao anunciar desafio: {e}")
-        await interaction.followup.send(f"⚠️ Desafio criado no DB (ID: {novo_desafio.id}), mas falhei ao tentar anunciá-lo. Erro: {e}")
+    return await anunciar_desafio(novo_desafio, parametros["nivel_nome"])
 
 ## FIM DOS COMANDOS ##
 
-client.run(TOKEN)
\ No newline at end of file
+async def executar_bot():
+    discord.utils.setup_logging()
+    async with client:
+        try:
+            await client.login(TOKEN)
+            await preparar_bot()
+            await client.connect()
+        finally:
+            await on_shutdown()
+
+if __name__ == "__main__":
+    asyncio.run(executar_bot())
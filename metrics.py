@@ -0,0 +1,255 @@
+import os
+import sys
+import math
+import time
+import bisect
+import inspect
+import functools
+import contextlib
+import contextvars
+from aiohttp import web
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108")) # 0 desliga o endpoint /metrics
+
+LIMITES_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+LIMITES_QUANTIDADE = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+LIMITES_TOKENS = (16, 64, 256, 1024, 4096, 16384)
+LIMITES_BYTES = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# nome -> (descrição, limites dos buckets)
+METRICAS = {
+    "bot_operacao_duracao_segundos": ("Tempo total de cada comando, evento ou tarefa.", LIMITES_SEGUNDOS),
+    "bot_operacao_queries": ("Queries no banco por comando, evento ou tarefa.", LIMITES_QUANTIDADE),
+    "bot_operacao_db_segundos": ("Tempo gasto no banco por comando, evento ou tarefa.", LIMITES_SEGUNDOS),
+    "bot_operacao_ollama_segundos": ("Tempo gasto no Ollama por comando, evento ou tarefa.", LIMITES_SEGUNDOS),
+    "bot_db_query_segundos": ("Duração de cada query no banco.", LIMITES_SEGUNDOS),
+    "bot_ollama_duracao_segundos": ("Duração de cada chamada ao /api/generate.", LIMITES_SEGUNDOS),
+    "bot_ollama_tokens": ("Tokens por chamada ao /api/generate (tipo=prompt|gerados).", LIMITES_TOKENS),
+    "bot_http_fetch_bytes": ("Tamanho do código baixado das submissões.", LIMITES_BYTES),
+    "bot_inicializacao_segundos": ("Tempo de cada etapa da inicialização do processo.", LIMITES_SEGUNDOS),
+    "bot_db_pool_espera_segundos": ("Espera por uma conexão livre no pool do banco (conexao=default|replica).", LIMITES_SEGUNDOS),
+}
+
+## HISTOGRAMAS ##
+
+class Histogram:
+    def __init__(self, limites: tuple):
+        self.limites = limites
+        self.contagens = [0] * (len(limites) + 1)
+        self.soma = 0.0
+        self.total = 0
+
+    def observe(self, valor: float):
+        self.contagens[bisect.bisect_left(self.limites, valor)] += 1
+        self.soma += valor
+        self.total += 1
+
+    def quantile(self, q: float) -> float:
+        # Estimativa pelo limite superior do bucket, como o histogram_quantile faz sem interpolar.
+        alvo = q * self.total
+        acumulado = 0
+        for limite, contagem in zip(self.limites + (math.inf,), self.contagens):
+            acumulado += contagem
+            if acumulado >= alvo:
+                return limite
+        return math.inf
+
+_series = {}
+
+def observe(metrica: str, valor: float, **labels):
+    chave = (metrica, tuple(sorted(labels.items())))
+    histograma = _series.get(chave)
+    if histograma is None:
+        histograma = _series[chave] = Histogram(METRICAS[metrica][1])
+    histograma.observe(valor)
+
+def operation_summary() -> list:
+    # Uma linha por operação, da que mais consumiu tempo no total para a que menos consumiu.
+    resumo = []
+    for (metrica, labels), duracao in _series.items():
+        if metrica != "bot_operacao_duracao_segundos":
+            continue
+
+        queries = _series[("bot_operacao_queries", labels)]
+        tempo_db = _series[("bot_operacao_db_segundos", labels)]
+        tempo_ollama = _series.get(("bot_operacao_ollama_segundos", labels))
+        resumo.append({
+            "nome": dict(labels)["operacao"],
+            "chamadas": duracao.total,
+            "tempo_total": duracao.soma,
+            "p50": duracao.quantile(0.5),
+            "p95": duracao.quantile(0.95),
+            "queries_media": queries.soma / queries.total,
+            "db_media": tempo_db.soma / tempo_db.total,
+            "ollama_media": tempo_ollama.soma / duracao.total if tempo_ollama else 0.0,
+        })
+    return sorted(resumo, key=lambda linha: linha["tempo_total"], reverse=True)
+
+## ESCOPO POR OPERAÇÃO ##
+# O escopo fica em um ContextVar, então as tasks criadas dentro de um comando
+# (ex: a análise em paralelo do /encerrar-votacao) somam no mesmo comando.
+
+class _Escopo:
+    def __init__(self):
+        self.queries = 0
+        self.tempo_db = 0.0
+        self.tempo_ollama = 0.0
+
+_escopo_atual = contextvars.ContextVar("escopo_metricas", default=None)
+_dentro_de_query = contextvars.ContextVar("dentro_de_query", default=False)
+
+def medir(nome: str):
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        async def medido(*args, **kwargs):
+            escopo = _Escopo()
+            token = _escopo_atual.set(escopo)
+            inicio = time.perf_counter()
+            try:
+                return await funcao(*args, **kwargs)
+            finally:
+                _escopo_atual.reset(token)
+                observe("bot_operacao_duracao_segundos", time.perf_counter() - inicio, operacao=nome)
+                observe("bot_operacao_queries", escopo.queries, operacao=nome)
+                observe("bot_operacao_db_segundos", escopo.tempo_db, operacao=nome)
+                if escopo.tempo_ollama:
+                    observe("bot_operacao_ollama_segundos", escopo.tempo_ollama, operacao=nome)
+        return medido
+    return decorador
+
+@contextlib.contextmanager
+def startup_step(tempos: list, etapa: str):
+    # Acumula (etapa, segundos) em tempos para o resumo impresso no fim da inicialização.
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracao = time.perf_counter() - inicio
+        tempos.append((etapa, duracao))
+        observe("bot_inicializacao_segundos", duracao, etapa=etapa)
+
+def format_startup(tempos: list) -> str:
+    total = sum(duracao for _, duracao in tempos)
+    return f"{total:.2f}s (" + " | ".join(f"{etapa} {duracao:.2f}s" for etapa, duracao in tempos) + ")"
+
+def record_ollama_call(modelo: str, duracao: float, tokens_prompt: int = None, tokens_gerados: int = None, host: str = None):
+    observe("bot_ollama_duracao_segundos", duracao, modelo=modelo, host=host or "")
+    if tokens_prompt is not None:
+        observe("bot_ollama_tokens", tokens_prompt, modelo=modelo, tipo="prompt")
+    if tokens_gerados is not None:
+        observe("bot_ollama_tokens", tokens_gerados, modelo=modelo, tipo="gerados")
+
+    escopo = _escopo_atual.get()
+    if escopo is not None:
+        escopo.tempo_ollama += duracao
+
+def record_fetch(tamanho: int):
+    observe("bot_http_fetch_bytes", tamanho)
+
+## QUERIES DO BANCO ##
+# O Tortoise não tem hook de query, então os métodos execute_* das classes de
+# conexão do backend em uso são embrulhados uma vez, depois do Tortoise.init.
+
+_METODOS_DE_QUERY = ("execute_query", "execute_query_dict", "execute_insert", "execute_many", "execute_script")
+
+def _wrap_query(metodo):
+    @functools.wraps(metodo)
+    async def executar(self, *args, **kwargs):
+        if _dentro_de_query.get():
+            return await metodo(self, *args, **kwargs)
+
+        token = _dentro_de_query.set(True)
+        inicio = time.perf_counter()
+        try:
+            return await metodo(self, *args, **kwargs)
+        finally:
+            _dentro_de_query.reset(token)
+            duracao = time.perf_counter() - inicio
+            observe("bot_db_query_segundos", duracao)
+
+            escopo = _escopo_atual.get()
+            if escopo is not None:
+                escopo.queries += 1
+                escopo.tempo_db += duracao
+
+    executar._medido = True
+    return executar
+
+def _wrap_pool_acquire(entrar):
+    @functools.wraps(entrar)
+    async def adquirir(self):
+        inicio = time.perf_counter()
+        try:
+            return await entrar(self)
+        finally:
+            observe("bot_db_pool_espera_segundos", time.perf_counter() - inicio, conexao=self.client.connection_name)
+
+    adquirir._medido = True
+    return adquirir
+
+def install_db_hooks():
+    from tortoise import connections
+    from tortoise.backends.base.client import BaseDBAsyncClient, PoolConnectionWrapper
+
+    if not getattr(PoolConnectionWrapper.__aenter__, "_medido", False):
+        PoolConnectionWrapper.__aenter__ = _wrap_pool_acquire(PoolConnectionWrapper.__aenter__)
+
+    modulo = sys.modules[type(connections.get("default")).__module__]
+    for classe in vars(modulo).values():
+        if not (inspect.isclass(classe) and issubclass(classe, BaseDBAsyncClient)):
+            continue
+        for nome in _METODOS_DE_QUERY:
+            metodo = classe.__dict__.get(nome)
+            if metodo is not None and not getattr(metodo, "_medido", False):
+                setattr(classe, nome, _wrap_query(metodo))
+
+## EXPOSIÇÃO ##
+
+def _formatar_labels(labels: tuple, extra: dict = None) -> str:
+    itens = list(labels) + list((extra or {}).items())
+    if not itens:
+        return ""
+    return "{" + ",".join(f'{chave}="{valor}"' for chave, valor in itens) + "}"
+
+def render_prometheus() -> str:
+    linhas = []
+    for nome, (descricao, _) in METRICAS.items():
+        linhas.append(f"# HELP {nome} {descricao}")
+        linhas.append(f"# TYPE {nome} histogram")
+        for (metrica, labels), histograma in sorted(_series.items(), key=lambda item: item[0]):
+            if metrica != nome:
+                continue
+            acumulado = 0
+            for limite, contagem in zip(histograma.limites, histograma.contagens):
+                acumulado += contagem
+                linhas.append(f"{nome}_bucket{_formatar_labels(labels, {'le': limite})} {acumulado}")
+            linhas.append(f"{nome}_bucket{_formatar_labels(labels, {'le': '+Inf'})} {histograma.total}")
+            linhas.append(f"{nome}_sum{_formatar_labels(labels)} {histograma.soma}")
+            linhas.append(f"{nome}_count{_formatar_labels(labels)} {histograma.total}")
+    return "\n".join(linhas) + "\n"
+
+_runner = None
+
+async def _handle_metrics(request):
+    return web.Response(text=render_prometheus(), content_type="text/plain", charset="utf-8")
+
+async def start_metrics_server():
+    global _runner
+
+    if _runner is not None or not METRICS_PORT:
+        return
+
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    _runner = web.AppRunner(app)
+    await _runner.setup()
+    await web.TCPSite(_runner, METRICS_HOST, METRICS_PORT).start()
+    print(f"[MÉTRICAS] Endpoint disponível em http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+async def stop_metrics_server():
+    global _runner
+
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
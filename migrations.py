@@ -0,0 +1,118 @@
+import re
+from tortoise import connections
+from tortoise.transactions import in_transaction
+from tortoise.utils import get_schema_sql
+
+from database import sql_param
+
+TABELA_MIGRACOES = "migracao"
+# Chave do pg_advisory_xact_lock: só um processo (bot ou worker.py) migra por vez.
+LOCK_MIGRACOES = 48151623
+
+## MIGRAÇÕES VERSIONADAS ##
+# Cada migração roda uma única vez, em ordem, dentro de uma transação junto com o
+# registro da versão. No dia a dia a inicialização só lê a tabela de versões, em
+# vez de inspecionar o schema inteiro como o generate_schemas fazia.
+# Para mudar o schema: altere o modelo em database.py e acrescente uma migração
+# no fim de MIGRACOES (nunca edite uma que já foi aplicada). Tabela nova é criada
+# pela 0001 em bancos novos, mas em bancos existentes precisa da sua migração;
+# coluna nova em tabela existente usa _adicionar_colunas.
+
+async def _schema_inicial(connection):
+    # Só cria as tabelas que faltam (CREATE TABLE IF NOT EXISTS): bancos anteriores às
+    # migrações ficam com as tabelas como estão. Colunas novas nessas tabelas vêm nas
+    # migrações seguintes (_adicionar_colunas) e os índices na 0003, depois delas,
+    # porque alguns dependem dessas colunas.
+    schema = get_schema_sql(connection, safe=True)
+    await connection.execute_script(
+        "\n".join(linha for linha in schema.splitlines() if not linha.startswith("CREATE INDEX"))
+    )
+
+async def _colunas_existentes(connection, tabela: str) -> set:
+    if connection.capabilities.dialect == "postgres":
+        _, linhas = await connection.execute_query(
+            "SELECT column_name AS nome FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND table_name = $1",
+            [tabela]
+        )
+    else:
+        _, linhas = await connection.execute_query(f"SELECT name AS nome FROM pragma_table_info('{tabela}')")
+    return {linha["nome"] for linha in linhas}
+
+async def _adicionar_colunas(connection, tabela: str, colunas: dict):
+    # Colunas novas em tabelas que já existem; as que já estiverem lá são puladas.
+    existentes = await _colunas_existentes(connection, tabela)
+    for coluna, tipo in colunas.items():
+        if coluna not in existentes:
+            await connection.execute_script(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {tipo}")
+
+async def _colunas_pre_avaliacao(connection):
+    # Nota e justificativa da pré-avaliação em segundo plano (NULL = ainda não avaliada).
+    await _adicionar_colunas(connection, "submissao", {"nota_ia": "INT NULL", "justificativa_ia": "TEXT NULL"})
+
+async def _criar_indices(connection):
+    # Cria os índices declarados nos modelos que ainda não existem. O generate_schemas
+    # só cria índices junto com a tabela, então tabelas antigas precisam disso.
+    # Índices sobre colunas que uma migração posterior ainda vai adicionar ficam para
+    # ela, que chama esta função de novo depois do _adicionar_colunas.
+    colunas = {}
+    for linha in get_schema_sql(connection, safe=True).splitlines():
+        if not linha.startswith("CREATE INDEX"):
+            continue
+        tabela, campos = re.search(r'ON "(\w+)" \(([^)]*)\)', linha).groups()
+        if tabela not in colunas:
+            colunas[tabela] = await _colunas_existentes(connection, tabela)
+        if set(re.findall(r'"(\w+)"', campos)) <= colunas[tabela]:
+            await connection.execute_script(linha)
+
+async def _tentativas_pre_avaliacao(connection):
+    # Contagem de falhas e próxima tentativa da pré-avaliação; o índice da fila passa
+    # a ordenar pelas tentativas, então o antigo (só data_submissao) sai.
+    timestamp = "TIMESTAMPTZ" if connection.capabilities.dialect == "postgres" else "TIMESTAMP"
+    await _adicionar_colunas(connection, "submissao", {
+        "tentativas_ia": "INT NOT NULL DEFAULT 0",
+        "proxima_tentativa_ia": f"{timestamp} NULL",
+    })
+    await connection.execute_script("DROP INDEX IF EXISTS idx_submissao_pendente_ia")
+    await _criar_indices(connection)
+
+MIGRACOES = [
+    ("0001_schema_inicial", _schema_inicial),
+    ("0002_colunas_pre_avaliacao", _colunas_pre_avaliacao),
+    # Voto (mensagem_id, usuario_id) e a fila parcial da pré-avaliação em Submissao.
+    ("0003_indices_votos_submissoes", _criar_indices),
+    ("0004_tentativas_pre_avaliacao", _tentativas_pre_avaliacao),
+]
+
+async def _versoes_aplicadas(connection) -> set:
+    _, linhas = await connection.execute_query(f"SELECT versao FROM {TABELA_MIGRACOES}")
+    return {linha["versao"] for linha in linhas}
+
+async def run_migrations() -> list:
+    connection = connections.get("default")
+    await connection.execute_script(
+        f"CREATE TABLE IF NOT EXISTS {TABELA_MIGRACOES} ("
+        "versao VARCHAR(100) NOT NULL PRIMARY KEY, "
+        "aplicada_em TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+    )
+
+    # Caminho comum: tudo aplicado, uma leitura e pronto.
+    if {versao for versao, _ in MIGRACOES} <= await _versoes_aplicadas(connection):
+        return []
+
+    aplicadas = []
+    for versao, migracao in MIGRACOES:
+        async with in_transaction() as transacao:
+            if transacao.capabilities.dialect == "postgres":
+                await transacao.execute_query("SELECT pg_advisory_xact_lock($1)", [LOCK_MIGRACOES])
+            # Outro processo pode ter aplicado enquanto esperávamos o lock.
+            if versao in await _versoes_aplicadas(transacao):
+                continue
+
+            await migracao(transacao)
+            await transacao.execute_query(
+                f"INSERT INTO {TABELA_MIGRACOES} (versao) VALUES ({sql_param(transacao, 1)})", [versao]
+            )
+        aplicadas.append(versao)
+        print(f"[MIGRAÇÃO] {versao} aplicada.")
+    return aplicadas
@@ -0,0 +1,121 @@
+import os
+import asyncio
+import aiohttp
+
+from http_client import get_session
+
+# Lista separada por vírgula; sem ela, usa o OLLAMA_HOST único de antes.
+OLLAMA_HOSTS = [
+    host.strip().rstrip("/")
+    for host in os.getenv("OLLAMA_HOSTS", os.getenv("OLLAMA_HOST", "http://localhost:11434")).split(",")
+    if host.strip()
+] or ["http://localhost:11434"]
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "15"))
+OLLAMA_HEALTH_TIMEOUT = float(os.getenv("OLLAMA_HEALTH_TIMEOUT", "3"))
+OLLAMA_EJECT_AFTER_FAILURES = int(os.getenv("OLLAMA_EJECT_AFTER_FAILURES", "3"))
+# Quantas requisições a mais um nó com o modelo já carregado pode ter em relação
+# ao menos ocupado e ainda assim ser escolhido (trocar de modelo custa segundos).
+OLLAMA_MODEL_AFFINITY_SLACK = int(os.getenv("OLLAMA_MODEL_AFFINITY_SLACK", "2"))
+
+## NÓS DO OLLAMA ##
+
+class OllamaNode:
+    def __init__(self, url: str):
+        self.url = url
+        self.em_andamento = 0
+        self.falhas = 0
+        self.saudavel = True
+        self.modelos_instalados = None # None = ainda não sondado; aceita qualquer modelo
+        self.modelos_carregados = set()
+
+    def serve(self, modelo: str) -> bool:
+        return self.modelos_instalados is None or _com_tag(modelo) in self.modelos_instalados
+
+def _com_tag(modelo: str) -> str:
+    # O Ollama lista "llama3" como "llama3:latest".
+    return modelo if ":" in modelo else f"{modelo}:latest"
+
+## BALANCEADOR ##
+# Escolhe o nó com menos requisições em andamento, preferindo quem já tem o
+# modelo na memória. Falhas de conexão/5xx seguidas tiram o nó da rotação; a
+# sondagem periódica do /api/tags o devolve quando ele volta a responder.
+
+class OllamaPool:
+    def __init__(self, hosts: list):
+        self.nodes = [OllamaNode(host) for host in hosts]
+        self._task = None
+
+    def healthy_nodes(self) -> list:
+        return [node for node in self.nodes if node.saudavel]
+
+    def pick(self, modelo: str, excluir: tuple = ()) -> OllamaNode:
+        candidatos = [node for node in self.healthy_nodes() if node.serve(modelo) and node not in excluir]
+        if not candidatos:
+            # Todos fora: tenta mesmo assim, para o erro real chegar a quem chamou.
+            candidatos = [node for node in self.nodes if node not in excluir] or self.nodes
+
+        menor_carga = min(node.em_andamento for node in candidatos)
+        com_modelo = [
+            node for node in candidatos
+            if _com_tag(modelo) in node.modelos_carregados and node.em_andamento <= menor_carga + OLLAMA_MODEL_AFFINITY_SLACK
+        ]
+        return min(com_modelo or candidatos, key=lambda node: node.em_andamento)
+
+    def report_success(self, node: OllamaNode, modelo: str):
+        node.falhas = 0
+        node.modelos_carregados.add(_com_tag(modelo))
+
+    def report_failure(self, node: OllamaNode, motivo: str):
+        node.falhas += 1
+        if node.saudavel and node.falhas >= OLLAMA_EJECT_AFTER_FAILURES:
+            node.saudavel = False
+            node.modelos_carregados.clear()
+            print(f"[OLLAMA] Nó {node.url} removido da rotação após {node.falhas} falhas seguidas: {motivo}")
+
+    ## SONDAGEM ##
+
+    async def probe(self, node: OllamaNode):
+        timeout = aiohttp.ClientTimeout(total=OLLAMA_HEALTH_TIMEOUT)
+        session = get_session()
+        try:
+            async with session.get(f"{node.url}/api/tags", timeout=timeout) as response:
+                response.raise_for_status()
+                instalados = {modelo["name"] for modelo in (await response.json()).get("models", [])}
+
+            # /api/ps lista o que está na memória; versões antigas do Ollama não têm.
+            carregados = None
+            async with session.get(f"{node.url}/api/ps", timeout=timeout) as response:
+                if response.status == 200:
+                    carregados = {modelo["name"] for modelo in (await response.json()).get("models", [])}
+        except Exception as e:
+            self.report_failure(node, f"sondagem: {e}")
+            return
+
+        node.modelos_instalados = instalados
+        if carregados is not None:
+            node.modelos_carregados = carregados
+        node.falhas = 0
+        if not node.saudavel:
+            node.saudavel = True
+            print(f"[OLLAMA] Nó {node.url} voltou para a rotação.")
+
+    async def probe_all(self):
+        await asyncio.gather(*(self.probe(node) for node in self.nodes))
+
+    async def _loop(self):
+        while True:
+            await self.probe_all()
+            await asyncio.sleep(OLLAMA_HEALTH_INTERVAL)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+            print(f"[OLLAMA] Balanceando entre {len(self.nodes)} nós: {', '.join(node.url for node in self.nodes)}")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+ollama_pool = OllamaPool(OLLAMA_HOSTS)
@@ -0,0 +1,71 @@
+import os
+import time
+from collections import OrderedDict
+from tortoise import connections
+
+from database import Usuario, sql_param
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "50000"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "3600"))
+
+USERNAME_PADRAO = "Usuário Desconhecido"
+
+## CACHE DE USUÁRIOS CONHECIDOS ##
+# Todo voto e toda submissão precisam que a linha do Usuario exista. Antes era um
+# get_or_create por evento (SELECT e às vezes INSERT); agora quem já foi visto neste
+# processo com o mesmo username não custa nenhuma query. Novos usuários e mudanças
+# de username viram um único INSERT ... ON CONFLICT. O TTL limita por quanto tempo
+# confiamos no cache se a linha for mexida por fora do bot.
+
+class UserCache:
+    def __init__(self, tamanho: int, ttl: float):
+        self.tamanho = tamanho
+        self.ttl = ttl
+        self._usuarios = OrderedDict() # discord_id -> (username, expira_em), do menos para o mais recente
+
+    def _conhecido(self, usuario_id: int, username: str, agora: float) -> bool:
+        entrada = self._usuarios.get(usuario_id)
+        if entrada is None or entrada[1] <= agora or entrada[0] != username:
+            return False
+        self._usuarios.move_to_end(usuario_id)
+        return True
+
+    def _lembrar(self, usuario_id: int, username: str, agora: float):
+        self._usuarios[usuario_id] = (username, agora + self.ttl)
+        self._usuarios.move_to_end(usuario_id)
+        while len(self._usuarios) > self.tamanho:
+            self._usuarios.popitem(last=False)
+
+    async def ensure(self, usuario_id: int, username: str):
+        await self.ensure_many({usuario_id: username})
+
+    async def ensure_many(self, usuarios: dict):
+        agora = time.monotonic()
+        novos = {
+            usuario_id: username or USERNAME_PADRAO for usuario_id, username in usuarios.items()
+            if not self._conhecido(usuario_id, username or USERNAME_PADRAO, agora)
+        }
+        if not novos:
+            return
+
+        connection = connections.get("default")
+        tabela = Usuario._meta.db_table
+        valores = ", ".join(
+            f"({sql_param(connection, 2 * posicao + 1)}, {sql_param(connection, 2 * posicao + 2)}, 0, 0, 0)"
+            for posicao in range(len(novos))
+        )
+        # O WHERE evita reescrever a linha (e gerar WAL) quando só faltava o cache.
+        await connection.execute_query(
+            f"""
+            INSERT INTO {tabela} (discord_id, username, pontos_total, pontos_semana, pontos_mes)
+            VALUES {valores}
+            ON CONFLICT (discord_id) DO UPDATE SET username = EXCLUDED.username
+            WHERE {tabela}.username <> EXCLUDED.username
+            """,
+            [valor for usuario in novos.items() for valor in usuario]
+        )
+
+        for usuario_id, username in novos.items():
+            self._lembrar(usuario_id, username, agora)
+
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
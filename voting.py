@@ -0,0 +1,425 @@
+import os
+import json
+import asyncio
+from tortoise.exceptions import IntegrityError
+from tortoise.expressions import F
+from tortoise.transactions import in_transaction
+
+from database import Desafio, Submissao, Usuario, Voto, padded, sql_param
+from ledger import ai_score_event, append_events, award_event, vote_event
+from user_cache import user_cache
+
+PONTOS_POR_VOTO_COMUNIDADE = 15
+PONTOS_POR_VOTO_JURADO = 30
+EMOJI_VOTO = "🌟"
+
+VOTE_BUFFER_FLUSH_MS = int(os.getenv("VOTE_BUFFER_FLUSH_MS", "500"))
+VOTE_BUFFER_MAX_EVENTS = int(os.getenv("VOTE_BUFFER_MAX_EVENTS", "200"))
+VOTE_BUFFER_LOG = os.getenv("VOTE_BUFFER_LOG", "votos_pendentes.log")
+FINALIZE_BATCH_SIZE = int(os.getenv("FINALIZE_BATCH_SIZE", "1000"))
+
+CAMPO_POR_TIPO_VOTO = {
+    "comunidade": "pontos_comunidade",
+    "jurado": "pontos_jurados",
+}
+
+PONTOS_POR_TIPO_VOTO = {
+    "comunidade": PONTOS_POR_VOTO_COMUNIDADE,
+    "jurado": PONTOS_POR_VOTO_JURADO,
+}
+
+## NÚCLEO ATÔMICO DE VOTAÇÃO ##
+# O Voto e o incremento dos pontos da Submissao vão na mesma transação, e o
+# incremento é feito pelo banco (pontos = pontos + n), então votos simultâneos
+# na mesma submissão nunca se sobrescrevem.
+
+async def _increment_submission(submissao_id: int, tipo_voto: str, pontos: int, connection):
+    campo = CAMPO_POR_TIPO_VOTO[tipo_voto]
+    await Submissao.filter(id=submissao_id).using_db(connection).update(**{
+        campo: F(campo) + pontos,
+        "pontos_total": F("pontos_total") + pontos,
+    })
+
+async def record_vote(submissao_id: int, usuario_id: int, username: str, tipo_voto: str, mensagem_id: int = None) -> bool:
+    await user_cache.ensure(usuario_id, username)
+
+    try:
+        async with in_transaction() as connection:
+            await Voto.create(
+                submissao_id=submissao_id,
+                usuario_id=usuario_id,
+                tipo_voto=tipo_voto,
+                mensagem_id=mensagem_id,
+                using_db=connection
+            )
+            await _increment_submission(submissao_id, tipo_voto, PONTOS_POR_TIPO_VOTO[tipo_voto], connection)
+            await append_events([vote_event(tipo_voto, submissao_id, usuario_id, PONTOS_POR_TIPO_VOTO[tipo_voto])], connection)
+    except IntegrityError:
+        # A constraint única (submissao, usuario) decide quem chegou primeiro.
+        return False
+
+    return True
+
+async def remove_vote(usuario_id: int, mensagem_id: int, tipo_voto: str):
+    async with in_transaction() as connection:
+        voto = await Voto.filter(
+            usuario_id=usuario_id,
+            mensagem_id=mensagem_id,
+            tipo_voto=tipo_voto
+        ).using_db(connection).first()
+
+        if voto is None:
+            return None
+
+        # Só quem de fato apagou a linha desconta os pontos.
+        removidos = await Voto.filter(id=voto.id).using_db(connection).delete()
+        if not removidos:
+            return None
+
+        await _increment_submission(voto.submissao_id, tipo_voto, -PONTOS_POR_TIPO_VOTO[tipo_voto], connection)
+        await append_events([vote_event(tipo_voto, voto.submissao_id, usuario_id, -PONTOS_POR_TIPO_VOTO[tipo_voto])], connection)
+
+    return voto.submissao_id
+
+## BUFFER DE VOTOS (WRITE-BEHIND) ##
+# As reações da comunidade só registram o estado desejado em memória, por
+# (mensagem, usuário): a última ação vence, então "adicionou e removeu" antes
+# do flush não gera nenhuma escrita. O flush compara esse estado com o banco
+# em lote, o que também o torna idempotente: reaplicar o log de replay depois
+# de um crash nunca conta um voto duas vezes.
+
+class VoteBuffer:
+    def __init__(self, flush_interval_ms: int, max_events: int, log_path: str):
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_events = max_events
+        self.log_path = log_path
+        self._pendentes = {}
+        self._eventos = 0
+        self._log = None
+        self._lock = asyncio.Lock()
+        self._cheio = asyncio.Event()
+        self._task = None
+
+    def add(self, mensagem_id: int, usuario_id: int, username: str):
+        self._registrar(mensagem_id, usuario_id, True, username)
+
+    def remove(self, mensagem_id: int, usuario_id: int):
+        self._registrar(mensagem_id, usuario_id, False, None)
+
+    def _registrar(self, mensagem_id: int, usuario_id: int, presente: bool, username: str, log: bool = True):
+        anterior = self._pendentes.get((mensagem_id, usuario_id))
+        if username is None and anterior:
+            username = anterior[1]
+        self._pendentes[(mensagem_id, usuario_id)] = (presente, username)
+
+        if log and self._log:
+            self._log.write(json.dumps({"m": mensagem_id, "u": usuario_id, "p": presente, "n": username}) + "\n")
+            self._log.flush()
+
+        self._eventos += 1
+        if self._eventos >= self.max_events:
+            self._cheio.set()
+
+    ## REPLAY LOG ##
+
+    def _replay(self, caminho: str) -> int:
+        if not os.path.exists(caminho):
+            return 0
+
+        total = 0
+        with open(caminho, encoding="utf-8") as arquivo:
+            for linha in arquivo:
+                try:
+                    evento = json.loads(linha)
+                except json.JSONDecodeError:
+                    continue  # última linha cortada pelo crash
+                self._registrar(evento["m"], evento["u"], evento["p"], evento["n"], log=False)
+                total += 1
+        return total
+
+    def _rotacionar_log(self) -> str:
+        # Os eventos do lote atual vão para um arquivo à parte; os que chegarem
+        # durante o flush continuam no log principal.
+        if self._log is None:
+            return None
+        self._log.close()
+        em_flush = self.log_path + ".flushing"
+        if os.path.exists(em_flush):
+            with open(em_flush, "a", encoding="utf-8") as destino, open(self.log_path, encoding="utf-8") as origem:
+                destino.write(origem.read())
+            os.remove(self.log_path)
+        else:
+            os.replace(self.log_path, em_flush)
+        self._log = open(self.log_path, "a", encoding="utf-8")
+        return em_flush
+
+    ## CICLO DE VIDA ##
+
+    async def start(self):
+        if self._task is not None:
+            return
+
+        recuperados = self._replay(self.log_path + ".flushing") + self._replay(self.log_path)
+        self._log = open(self.log_path, "a", encoding="utf-8")
+        if recuperados:
+            print(f"[VOTOS] {recuperados} eventos recuperados do log de replay.")
+            await self.flush()
+
+        self._task = asyncio.create_task(self._loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        await self.flush()
+
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._cheio.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"[ERRO] Falha ao gravar lote de votos (será tentado de novo): {e}")
+
+    ## FLUSH EM LOTE ##
+
+    async def flush(self):
+        async with self._lock:
+            if not self._pendentes:
+                return
+
+            lote = self._pendentes
+            self._pendentes = {}
+            self._eventos = 0
+            self._cheio.clear()
+            arquivo_lote = self._rotacionar_log()
+
+            try:
+                await self._aplicar(lote)
+            except Exception:
+                # Devolve o lote sem sobrescrever ações mais novas do mesmo usuário.
+                for chave, valor in lote.items():
+                    self._pendentes.setdefault(chave, valor)
+                raise
+
+            if arquivo_lote and os.path.exists(arquivo_lote):
+                os.remove(arquivo_lote)
+
+    async def _aplicar(self, lote: dict):
+        mensagens = {mensagem_id for mensagem_id, _ in lote}
+        # O índice já conhece cédulas recém-postadas cujo id ainda não foi salvo no banco.
+        submissao_por_mensagem = {
+            mensagem_id: vote_index.get(mensagem_id)[0] for mensagem_id in mensagens if vote_index.get(mensagem_id)
+        }
+        faltando = mensagens - submissao_por_mensagem.keys()
+        if faltando:
+            submissao_por_mensagem.update(await Submissao.filter(
+                mensagem_votacao_id__in=padded(faltando),
+                desafio__status=Desafio.Status.VOTACAO
+            ).values_list("mensagem_votacao_id", "id"))
+
+        # Reações em mensagens que não são cédulas são descartadas aqui.
+        lote = {chave: valor for chave, valor in lote.items() if chave[0] in submissao_por_mensagem}
+        if not lote:
+            return
+
+        await user_cache.ensure_many(
+            {usuario_id: username for (_, usuario_id), (presente, username) in lote.items() if presente}
+        )
+
+        try:
+            async with in_transaction() as connection:
+                await self._aplicar_em_transacao(lote, submissao_por_mensagem, connection)
+        except IntegrityError:
+            # Algum voto entrou por outro caminho (ex: botão) entre a leitura e o insert.
+            # Cai para o caminho unitário, que resolve cada conflito isoladamente.
+            for (mensagem_id, usuario_id), (presente, username) in lote.items():
+                if presente:
+                    await record_vote(submissao_por_mensagem[mensagem_id], usuario_id, username, "comunidade", mensagem_id)
+                else:
+                    await remove_vote(usuario_id, mensagem_id, "comunidade")
+
+    async def _aplicar_em_transacao(self, lote: dict, submissao_por_mensagem: dict, connection):
+        existentes = await Voto.filter(
+            submissao_id__in=padded(set(submissao_por_mensagem.values())),
+            usuario_id__in=padded({usuario_id for _, usuario_id in lote})
+        ).using_db(connection).values("id", "submissao_id", "usuario_id", "tipo_voto")
+        existentes = {(voto["submissao_id"], voto["usuario_id"]): voto for voto in existentes}
+
+        inserir = []
+        apagar = []
+        eventos = []
+        delta_por_submissao = {}
+
+        for (mensagem_id, usuario_id), (presente, _) in lote.items():
+            submissao_id = submissao_por_mensagem[mensagem_id]
+            voto = existentes.get((submissao_id, usuario_id))
+
+            if presente and voto is None:
+                inserir.append(Voto(submissao_id=submissao_id, usuario_id=usuario_id, tipo_voto="comunidade", mensagem_id=mensagem_id))
+                eventos.append(vote_event("comunidade", submissao_id, usuario_id, PONTOS_POR_VOTO_COMUNIDADE))
+                delta_por_submissao[submissao_id] = delta_por_submissao.get(submissao_id, 0) + PONTOS_POR_VOTO_COMUNIDADE
+            elif not presente and voto is not None and voto["tipo_voto"] == "comunidade":
+                apagar.append(voto["id"])
+                eventos.append(vote_event("comunidade", submissao_id, usuario_id, -PONTOS_POR_VOTO_COMUNIDADE))
+                delta_por_submissao[submissao_id] = delta_por_submissao.get(submissao_id, 0) - PONTOS_POR_VOTO_COMUNIDADE
+
+        if inserir:
+            await Voto.bulk_create(inserir, using_db=connection)
+        if apagar:
+            await Voto.filter(id__in=apagar).using_db(connection).delete()
+
+        for submissao_id, delta in delta_por_submissao.items():
+            if delta:
+                await _increment_submission(submissao_id, "comunidade", delta, connection)
+
+        await append_events(eventos, connection)
+
+vote_buffer = VoteBuffer(VOTE_BUFFER_FLUSH_MS, VOTE_BUFFER_MAX_EVENTS, VOTE_BUFFER_LOG)
+
+## ÍNDICE DE MENSAGENS DE VOTAÇÃO ##
+# mensagem_votacao_id -> (submissao_id, desafio_id, status). Só guarda cédulas de
+# desafios em VOTACAO, então reações em qualquer outra mensagem (cabeçalho,
+# rodapé, desafios fechados) são descartadas sem ir ao banco.
+
+class VoteMessageIndex:
+    def __init__(self):
+        self._por_mensagem = {}
+
+    async def load(self):
+        cedulas = await Submissao.filter(
+            desafio__status=Desafio.Status.VOTACAO,
+            mensagem_votacao_id__isnull=False
+        ).values_list("mensagem_votacao_id", "id", "desafio_id")
+
+        self._por_mensagem = {
+            mensagem_id: (submissao_id, desafio_id, Desafio.Status.VOTACAO)
+            for mensagem_id, submissao_id, desafio_id in cedulas
+        }
+        print(f"[VOTOS] Índice de votação carregado com {len(self._por_mensagem)} cédulas.")
+
+    def get(self, mensagem_id: int):
+        return self._por_mensagem.get(mensagem_id)
+
+    def register(self, mensagem_id: int, submissao_id: int, desafio_id: int):
+        self._por_mensagem[mensagem_id] = (submissao_id, desafio_id, Desafio.Status.VOTACAO)
+
+    async def resolve(self, mensagem_id: int, submissao_id: int):
+        # Cédula postada por outro processo (outro shard ou worker): confere no banco
+        # se o desafio ainda está em votação e passa a conhecê-la aqui.
+        desafio_id = await Submissao.filter(
+            id=submissao_id, desafio__status=Desafio.Status.VOTACAO
+        ).first().values_list("desafio_id", flat=True)
+        if desafio_id is None:
+            return None
+        self.register(mensagem_id, submissao_id, desafio_id)
+        return self.get(mensagem_id)
+
+    def close_challenge(self, desafio_id: int):
+        self._por_mensagem = {
+            mensagem_id: entrada for mensagem_id, entrada in self._por_mensagem.items()
+            if entrada[1] != desafio_id
+        }
+
+vote_index = VoteMessageIndex()
+
+## APURAÇÃO DO DESAFIO ##
+# Notas da IA e prêmios de todos os participantes são aplicados em uma única
+# transação, com UPDATEs em lote feitos pelo banco (pontos = pontos + n). O
+# desafio fica em APURACAO até o commit e vira FECHADO na mesma transação: se
+# o processo cair no meio, nada foi aplicado e basta encerrar de novo.
+
+async def _apply_ai_scores(linhas: list, connection):
+    tabela = Submissao._meta.db_table
+
+    for inicio in range(0, len(linhas), FINALIZE_BATCH_SIZE):
+        valores = []
+        parametros = []
+        for submissao_id, nota, justificativa in linhas[inicio:inicio + FINALIZE_BATCH_SIZE]:
+            posicao = len(parametros)
+            valores.append(
+                f"(CAST({sql_param(connection, posicao + 1)} AS INTEGER), "
+                f"CAST({sql_param(connection, posicao + 2)} AS INTEGER), "
+                f"CAST({sql_param(connection, posicao + 3)} AS TEXT))"
+            )
+            parametros += [submissao_id, nota, justificativa]
+
+        await connection.execute_query(
+            f"""
+            WITH notas (id, nota, justificativa) AS (VALUES {", ".join(valores)})
+            UPDATE {tabela}
+            SET pontos_total = {tabela}.pontos_total + COALESCE(notas.nota, 0) - {tabela}.pontos_ia,
+                pontos_ia = COALESCE(notas.nota, 0),
+                nota_ia = notas.nota,
+                justificativa_ia = notas.justificativa
+            FROM notas
+            WHERE {tabela}.id = notas.id
+            """,
+            parametros
+        )
+
+async def _award_participants(desafio_id: int, connection):
+    tabela = Usuario._meta.db_table
+
+    await connection.execute_query(
+        f"""
+        UPDATE {tabela}
+        SET pontos_total = {tabela}.pontos_total + premios.pontos,
+            pontos_mes = {tabela}.pontos_mes + premios.pontos,
+            pontos_semana = {tabela}.pontos_semana + premios.pontos
+        FROM (
+            SELECT usuario_id, SUM(pontos_total) AS pontos
+            FROM {Submissao._meta.db_table}
+            WHERE desafio_id = {sql_param(connection, 1)}
+            GROUP BY usuario_id
+        ) AS premios
+        WHERE {tabela}.discord_id = premios.usuario_id
+        """,
+        [desafio_id]
+    )
+
+async def apply_challenge_results(desafio_id: int, notas: dict) -> bool:
+    # notas: submissao_id -> (nota, justificativa); nota None = IA não avaliou.
+    async with in_transaction() as connection:
+        desafio = await Desafio.select_for_update().using_db(connection).get_or_none(id=desafio_id)
+        if desafio is None or desafio.status != Desafio.Status.APURACAO:
+            # Outra execução já aplicou (ou o desafio não foi encerrado).
+            return False
+
+        pontos_ia_atuais = dict(
+            await Submissao.filter(desafio_id=desafio_id).using_db(connection).values_list("id", "pontos_ia")
+        )
+
+        linhas = []
+        eventos = []
+        for submissao_id, (nota, justificativa) in notas.items():
+            if submissao_id not in pontos_ia_atuais:
+                continue
+            # Sem nota (ex: código inacessível) a submissão fica com 0 da IA, mas o motivo é
+            # gravado em justificativa_ia para aparecer no resultado.
+            linhas.append((submissao_id, nota, justificativa))
+            eventos.append(ai_score_event(submissao_id, (nota or 0) - pontos_ia_atuais[submissao_id]))
+
+        await _apply_ai_scores(linhas, connection)
+        await _award_participants(desafio_id, connection)
+
+        premios = await Submissao.filter(desafio_id=desafio_id).using_db(connection).values_list(
+            "id", "usuario_id", "pontos_total"
+        )
+        eventos += [award_event(usuario_id, submissao_id, pontos) for submissao_id, usuario_id, pontos in premios]
+        await append_events(eventos, connection)
+
+        desafio.status = Desafio.Status.FECHADO
+        await desafio.save(using_db=connection, update_fields=["status"])
+
+    return True
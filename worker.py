@@ -0,0 +1,64 @@
+import signal
+import asyncio
+import argparse
+
+# Importar o main registra os handlers da fila; o cliente nunca conecta ao gateway aqui.
+import main
+from database import close_db, init_db
+from http_client import close_http, init_http
+from jobs import JOB_WORKERS, job_queue
+from metrics import format_startup, install_db_hooks, start_metrics_server, startup_step, stop_metrics_server
+from migrations import run_migrations
+from ollama_pool import ollama_pool
+
+## WORKER DE IA ##
+# Processo separado para o trabalho pesado (Ollama + download do código), com
+# AI_WORKER_MODE=remoto no bot. Conversa com o gateway só pela fila no banco,
+# então pode rodar em outros núcleos ou em outras máquinas, quantos forem
+# necessários. Mensagens no Discord saem pela API REST, sem sessão de gateway.
+
+async def run(args):
+    tempos = []
+    with startup_step(tempos, "banco"):
+        await init_db()
+        install_db_hooks()
+    with startup_step(tempos, "migracoes"):
+        await run_migrations()
+    with startup_step(tempos, "http"):
+        await init_http()
+        ollama_pool.start()
+        await start_metrics_server()
+    with startup_step(tempos, "discord"):
+        await main.client.login(main.TOKEN)
+
+    job_queue.start(args.workers, tipos=main.TAREFAS_DE_IA)
+    if args.pre_avaliacao:
+        main.pre_avaliar_submissoes.start()
+
+    parar = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sinal in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sinal, parar.set)
+
+    print(f"[WORKER] Worker de IA no ar com {args.workers} workers em {format_startup(tempos)}")
+    try:
+        await parar.wait()
+    finally:
+        print("[WORKER] Encerrando...")
+        await job_queue.close()
+        if main.pre_avaliar_submissoes.is_running():
+            main.pre_avaliar_submissoes.cancel()
+        await main.client.close()
+        await ollama_pool.close()
+        await stop_metrics_server()
+        await close_http()
+        await close_db()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Executa as tarefas de IA da fila fora do processo do bot.")
+    parser.add_argument("--workers", type=int, default=JOB_WORKERS, help="Tarefas executadas ao mesmo tempo neste processo.")
+    parser.add_argument("--pre-avaliacao", action="store_true", help="Também pré-avalia submissões com o Ollama ocioso. Ligue em um só worker.")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))